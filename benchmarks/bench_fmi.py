@@ -0,0 +1,275 @@
+"""Times each stage of the .fmi render pipeline in isolation.
+
+Run from the repository root (FmiText loads ./fonts):
+
+    python -m benchmarks.bench_fmi [--iterations N] [--stages decode,text]
+                                   [--output results.json]
+                                   [--baseline baseline.json] [--threshold 1.25]
+
+Stages are decode, colors_exact, colors_fast, colors_v2, text, text_cached,
+avatar, composite and encode. Inputs are the images in examples/ plus a synthetic
+corpus generated on the fly (Last.fm 174px up to 2000px, grayscale, RGBA,
+palette and CMYK JPEG) and a set of Latin, long, RTL, CJK and emoji titles,
+so the suite needs no network access.
+
+For every stage and input the p50 and p95 wall time and the peak Python heap
+(tracemalloc, which sees numpy buffers but not PIL's) are reported, plus the
+output size for stages that produce bytes. encode runs once per output
+profile, so the CPU and upload size trade-off can be read off directly. With
+--baseline, p50 times are compared against a previous --output file and the
+exit status is 1 if any got slower than --threshold times the baseline.
+
+Like the render workers, everything runs single threaded.
+"""
+
+import argparse
+import json
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from io import BytesIO
+from pathlib import Path
+from typing import NamedTuple
+
+import cv2
+import numpy as np
+from PIL import Image
+from threadpoolctl import threadpool_limits
+
+from cogs.utils.album_art.decoder import decode_image
+from cogs.utils.dominant_colors import (
+    dominant_colors,
+    dominant_colors_fast,
+    dominant_colors_v2,
+)
+from cogs.utils.fmi_builder import OUTPUT_PROFILES, FmiBuilder
+from cogs.utils.fmi_text import FmiText
+
+EXAMPLES = Path(__file__).resolve().parent.parent / "examples"
+
+
+class LastFmParameters(NamedTuple):
+    # Mirrors cogs.fmi.LastFmParameters without importing the cog, which
+    # needs a configured .env
+    title: str
+    artist: str
+    album: str
+    albumartlink: str
+
+
+TITLES = {
+    "latin": LastFmParameters("Pacific", "Haruomi Hosono", "Pacific", ""),
+    "long": LastFmParameters(
+        "Music for 18 Musicians: Section IIIA, Section IIIB and Pulses (Live at the Barbican)",
+        "Steve Reich and Musicians, Ensemble Modern, Synergy Vocals",
+        "Music for 18 Musicians (Remastered Deluxe Anniversary Edition with Bonus Tracks)",
+        "",
+    ),
+    "arabic": LastFmParameters("لما بدا يتثنى", "فيروز", "أندلسيات", ""),
+    "hebrew": LastFmParameters("ירושלים של זהב", "נעמי שמר", "שירים", ""),
+    "cjk": LastFmParameters(
+        "真夜中のドア〜stay with me", "松原みき", "ポケットパーク", ""
+    ),
+    "emoji": LastFmParameters("✨ Glow ✨ 🌙", "Artist 🎧", "Night Drive 🚗💨", ""),
+}
+
+
+def _synthetic_art(size, seed):
+    """Deterministic artwork: a gradient with a few flat colour blocks and a
+    little noise, which gives the clusterer something realistic to find."""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:size, 0:size] / size
+    base = rng.uniform(0, 255, 3)
+    img = np.empty((size, size, 3), dtype=np.float64)
+    for c in range(3):
+        img[..., c] = base[c] * (0.5 + 0.5 * x) + rng.uniform(-60, 60) * y
+    for _ in range(4):
+        x0, y0 = rng.integers(0, size, 2)
+        w, h = rng.integers(size // 8, size // 2, 2)
+        img[y0 : y0 + h, x0 : x0 + w] = rng.uniform(0, 255, 3)
+    img += rng.normal(0, 6, img.shape)
+    return Image.fromarray(np.clip(img, 0, 255).astype(np.uint8), "RGB")
+
+
+def _encode(image, mode, fmt):
+    out = BytesIO()
+    image.convert(mode).save(out, fmt, **({"quality": 90} if fmt == "JPEG" else {}))
+    return out.getvalue()
+
+
+def build_corpus():
+    corpus = {path.stem: path.read_bytes() for path in sorted(EXAMPLES.glob("*.png"))}
+    for size in (174, 300, 640, 1200, 2000):
+        corpus[f"jpeg_{size}"] = _encode(_synthetic_art(size, size), "RGB", "JPEG")
+    art = _synthetic_art(640, 7)
+    corpus["gray_640"] = _encode(art, "L", "PNG")
+    corpus["rgba_640"] = _encode(art, "RGBA", "PNG")
+    corpus["palette_640"] = _encode(art, "P", "PNG")
+    corpus["cmyk_640"] = _encode(art, "CMYK", "JPEG")
+    return corpus
+
+
+def _cold_text(params):
+    FmiText.layout_cache.clear()
+    return FmiText(params)
+
+
+def _measure(fn, iterations):
+    out = fn()  # warm up caches and lazy imports outside the timings
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    samples.sort()
+    return {
+        "p50_ms": statistics.median(samples),
+        "p95_ms": samples[min(len(samples) - 1, round(0.95 * (len(samples) - 1)))],
+        "peak_kb": peak / 1024,
+        # Encoded size, for the stages that produce a file
+        "size_kb": len(out) / 1024 if isinstance(out, bytes) else None,
+        "iterations": iterations,
+    }
+
+
+def build_cases(corpus, iterations, slow_iterations):
+    decoded = {name: decode_image(data) for name, data in corpus.items()}
+    avatar_png = _encode(_synthetic_art(128, 128), "RGB", "PNG")
+    avatar_tile = FmiBuilder.mask_and_resize_discord_avatar(avatar_png)
+    texts = {name: FmiText(params) for name, params in TITLES.items()}
+    palette = ([40, 60, 90], [220, 180, 60])
+
+    def builder(album, text):
+        return FmiBuilder(album, avatar_tile, text, palette=palette)
+
+    composed = builder(decoded["jpeg_640"], texts["latin"]).compose()
+
+    cases = []
+    for name, data in corpus.items():
+        cases.append(("decode", name, lambda d=data: decode_image(d), iterations))
+    for stage, fn, n in (
+        ("colors_exact", dominant_colors, slow_iterations),
+        ("colors_fast", dominant_colors_fast, iterations),
+        ("colors_v2", dominant_colors_v2, slow_iterations),
+    ):
+        for name, album in decoded.items():
+            cases.append((stage, name, lambda f=fn, a=album: f(a.rgba), n))
+    for name, params in TITLES.items():
+        # text is the cold cost of shaping and wrapping, text_cached a repeat
+        # title served from the layout cache
+        cases.append(("text", name, lambda p=params: _cold_text(p), iterations))
+        cases.append(("text_cached", name, lambda p=params: FmiText(p), iterations))
+    cases.append(
+        (
+            "avatar",
+            "128px",
+            lambda: FmiBuilder.mask_and_resize_discord_avatar(avatar_png),
+            iterations,
+        )
+    )
+    for name in ("jpeg_174", "jpeg_640", "jpeg_2000"):
+        for text_name in ("latin", "arabic", "cjk"):
+            cases.append(
+                (
+                    "composite",
+                    f"{name}/{text_name}",
+                    lambda a=decoded[name], t=texts[text_name]: builder(a, t).compose(),
+                    iterations,
+                )
+            )
+    for profile in OUTPUT_PROFILES:
+        cases.append(
+            (
+                "encode",
+                profile,
+                lambda p=profile: FmiBuilder.encode(composed, p).getvalue(),
+                iterations,
+            )
+        )
+    return cases
+
+
+def compare(results, baseline, threshold):
+    regressions = []
+    print(f"\n{'case':<40}{'baseline':>12}{'now':>12}{'ratio':>8}")
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+        before = baseline[key]["p50_ms"]
+        ratio = result["p50_ms"] / before if before else 1.0
+        flag = "  SLOWER" if ratio > threshold else ""
+        print(
+            f"{key:<40}{before:>10.2f}ms{result['p50_ms']:>10.2f}ms{ratio:>8.2f}{flag}"
+        )
+        if ratio > threshold:
+            regressions.append(key)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument(
+        "--slow-iterations",
+        type=int,
+        default=3,
+        help="iterations for the full KMeans stages",
+    )
+    parser.add_argument("--stages", help="comma separated stages to run")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--baseline", help="JSON results to compare against")
+    parser.add_argument("--threshold", type=float, default=1.25)
+    args = parser.parse_args(argv)
+
+    cv2.setNumThreads(1)
+    stages = set(args.stages.split(",")) if args.stages else None
+
+    results = {}
+    print(f"{'case':<40}{'p50':>12}{'p95':>12}{'peak':>12}{'size':>12}")
+    with threadpool_limits(limits=1):
+        cases = build_cases(build_corpus(), args.iterations, args.slow_iterations)
+        for stage, name, fn, iterations in cases:
+            if stages is not None and stage not in stages:
+                continue
+            key = f"{stage}/{name}"
+            result = results[key] = _measure(fn, iterations)
+            size = result["size_kb"]
+            print(
+                f"{key:<40}{result['p50_ms']:>10.2f}ms{result['p95_ms']:>10.2f}ms"
+                f"{result['peak_kb']:>10.0f}KB"
+                + (f"{size:>10.1f}KB" if size is not None else "")
+            )
+
+    if args.output:
+        payload = {
+            "meta": {
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "machine": platform.machine(),
+                "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            },
+            "results": results,
+        }
+        Path(args.output).write_text(json.dumps(payload, indent=2))
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())["results"]
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(
+                f"\n{len(regressions)} case(s) slower than {args.threshold}x baseline"
+            )
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,153 @@
+"""Compares how long .cd really takes with the old sleep loop and with
+CountdownScheduler.
+
+Run from the repository root:
+
+    python -m benchmarks.countdown_drift [--runs N] [--latency MS] [--seed S]
+
+Messages are fake. An edit reaches "Discord" after half its round trip,
+which is when it shows, and returns after the whole of it. Round trips are
+log-normal around --latency, with the occasional multi-second stall. Each
+channel allows 5 edits per 5 seconds, and like discord.py a request waits
+for room in that bucket before it is sent. A separate run puts a .cd and a
+.scd in the same channel, which the old loop could only serve by waiting on
+the bucket. Reports when "Go!" showed relative to the ideal and how many
+numbers were shown.
+"""
+
+import argparse
+import asyncio
+import random
+import statistics
+import sys
+import time
+from collections import deque
+
+from cogs.utils.countdown_scheduler import EDIT_LIMIT, EDIT_WINDOW, CountdownScheduler
+
+
+class FakeChannel:
+    def __init__(self, channel_id):
+        self.id = channel_id
+        self.edits = deque()
+
+    async def wait_for_bucket(self):
+        while len(self.edits) >= EDIT_LIMIT:
+            wait = self.edits[0] + EDIT_WINDOW - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            else:
+                self.edits.popleft()
+        self.edits.append(time.monotonic())
+
+
+class FakeMessage:
+    def __init__(self, channel, latency, rng):
+        self.channel = channel
+        self.latency = latency
+        self.rng = rng
+        self.shown = []
+        self.done = asyncio.Event()
+
+    def round_trip(self):
+        if self.rng.random() < 0.02:
+            return self.rng.uniform(1.0, 3.0)
+        return self.rng.lognormvariate(0, 0.5) * self.latency
+
+    async def send(self, content):
+        rtt = self.round_trip()
+        await asyncio.sleep(rtt / 2)
+        self.shown.append((time.monotonic(), content))
+        await asyncio.sleep(rtt / 2)
+        return self
+
+    async def edit(self, content):
+        await self.channel.wait_for_bucket()
+        await self.send(content)
+        if content == "Go!":
+            self.done.set()
+
+
+async def old_countdown(message, seconds):
+    await message.send(str(seconds))
+    await asyncio.sleep(1)
+    for num in range(seconds - 1, 0, -1):
+        await message.edit(content=num)
+        await asyncio.sleep(1)
+    await message.edit(content="Go!")
+
+
+async def new_countdown(scheduler, message, seconds):
+    start = time.monotonic()
+    await message.send(str(seconds))
+    scheduler.add(message, seconds, start)
+    await message.done.wait()
+
+
+def summarise(messages, seconds):
+    """Returns how late "Go!" showed against the first number, plus the
+    numbers shown, averaged."""
+    late = []
+    numbers = []
+    for message in messages:
+        first, _ = message.shown[0]
+        go = next(t for t, content in message.shown if content == "Go!")
+        late.append(go - first - seconds)
+        numbers.append(len(message.shown) - 1)
+    return late, statistics.mean(numbers)
+
+
+async def run(mode, runs, latency, seed, shared):
+    rng = random.Random(seed)
+    scheduler = CountdownScheduler()
+    tasks = []
+    messages = []
+    for i in range(runs):
+        channel = FakeChannel(i)
+        pairs = [(10, FakeMessage(channel, latency, rng))]
+        if shared:
+            pairs.append((5, FakeMessage(channel, latency, rng)))
+        for seconds, message in pairs:
+            messages.append((seconds, message))
+            if mode == "old":
+                tasks.append(old_countdown(message, seconds))
+            else:
+                tasks.append(new_countdown(scheduler, message, seconds))
+    await asyncio.gather(*tasks)
+    scheduler.close()
+
+    results = {}
+    for seconds in sorted({s for s, _ in messages}):
+        results[seconds] = summarise([m for s, m in messages if s == seconds], seconds)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=150)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(
+        f"{'mode':<6}{'channel':<12}{'count':>6}{'late p50 s':>12}"
+        f"{'late p95 s':>12}{'late max s':>12}{'numbers':>9}"
+    )
+    for shared in (False, True):
+        for mode in ("old", "new"):
+            results = asyncio.run(
+                run(mode, args.runs, args.latency / 1000, args.seed, shared)
+            )
+            for seconds, (late, numbers) in results.items():
+                late.sort()
+                p95 = late[int(len(late) * 0.95)]
+                print(
+                    f"{mode:<6}{'shared' if shared else 'own':<12}{seconds:>6}"
+                    f"{statistics.median(late):>12.2f}{p95:>12.2f}{late[-1]:>12.2f}"
+                    f"{numbers:>9.1f}"
+                )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
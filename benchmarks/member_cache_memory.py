@@ -0,0 +1,210 @@
+"""Compares the memory the gateway cache holds with and without LOW_MEMORY.
+
+Run from the repository root:
+
+    python -m benchmarks.member_cache_memory [--guilds N] [--seed S]
+
+Each mode runs in a fresh interpreter that builds the bot, then feeds its
+connection state the GUILD_CREATE payloads and, where the bot would chunk,
+the member chunks of --guilds synthetic servers. Server sizes follow a long
+tail like a public bot's: most have a few dozen members, a handful tens of
+thousands, and people share servers. Reports the memory still held once
+every server is ready (the growth in resident memory) and the peak RSS of
+the process, which also covers building the payloads.
+"""
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Discord leaves the member list out of GUILD_CREATE above this size
+LARGE_THRESHOLD = 250
+CHUNK_SIZE = 1000
+BOT_ID = 516324491618680832
+
+
+def guild_sizes(guilds, rng):
+    return [min(150_000, int(8 * rng.paretovariate(0.8))) + 2 for _ in range(guilds)]
+
+
+def member_payload(user_id, role_ids, rng):
+    return {
+        "user": {
+            "id": str(user_id),
+            "username": f"user{user_id % 1_000_000}",
+            "discriminator": f"{user_id % 10000:04}",
+            "avatar": f"{rng.getrandbits(128):032x}" if rng.random() < 0.7 else None,
+            "bot": user_id == BOT_ID,
+        },
+        "roles": rng.sample(role_ids, min(len(role_ids), rng.randint(0, 3))),
+        "joined_at": "2021-06-01T12:00:00.000000+00:00",
+        "nick": f"nick{user_id % 997}" if rng.random() < 0.1 else None,
+        "deaf": False,
+        "mute": False,
+    }
+
+
+def guild_payload(guild_id, size):
+    role_ids = [str(guild_id + i) for i in range(1, 6)]
+    roles = [
+        {
+            "id": role_id,
+            "name": f"role {role_id}",
+            "permissions": "0",
+            "position": i,
+            "color": 0,
+            "hoist": False,
+            "managed": False,
+            "mentionable": False,
+        }
+        for i, role_id in enumerate([str(guild_id)] + role_ids)
+    ]
+    channels = [
+        {
+            "id": str(guild_id + 100 + i),
+            "type": 0,
+            "name": f"channel-{i}",
+            "position": i,
+        }
+        for i in range(10)
+    ]
+    return {
+        "id": str(guild_id),
+        "name": f"server {guild_id}",
+        "owner_id": "1",
+        "member_count": size,
+        "large": size > LARGE_THRESHOLD,
+        "roles": roles,
+        "channels": channels,
+        "emojis": [],
+        "stickers": [],
+        "features": [],
+        "members": [],
+    }, role_ids
+
+
+def rss_mb():
+    """Resident memory of this process right now, or its peak where /proc
+    isn't available."""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except OSError:
+        import resource
+
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_child(guilds, seed):
+    import gc
+    import resource
+    import time
+
+    import discord
+
+    from bot import Cosmo
+
+    bot = Cosmo([])
+    state = bot._connection
+    rng = random.Random(seed)
+    sizes = guild_sizes(guilds, rng)
+    # People are in several servers, so draw members from a smaller pool
+    users = max(sizes) + sum(sizes) * 6 // 10
+
+    gc.collect()
+    before = rss_mb()
+    start = time.perf_counter()
+    for index, size in enumerate(sizes):
+        guild_id = (index + 1) << 22
+        data, role_ids = guild_payload(guild_id, size)
+        member_ids = [BOT_ID] + rng.sample(range(10**15, 10**15 + users), size - 1)
+        members = [member_payload(user_id, role_ids, rng) for user_id in member_ids]
+        if data["large"]:
+            # Only the bot itself comes with the event, the rest is chunked
+            data["members"], chunks = members[:1], members[1:]
+        else:
+            data["members"], chunks = members, []
+
+        guild = discord.Guild(data=data, state=state)
+        state._add_guild(guild)
+        if state._chunk_guilds:
+            for i in range(0, len(chunks), CHUNK_SIZE):
+                for member_data in chunks[i : i + CHUNK_SIZE]:
+                    member = discord.Member(data=member_data, guild=guild, state=state)
+                    guild._add_member(member)
+        del data, members, chunks
+
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    held = rss_mb() - before
+    return {
+        "guilds": len(state.guilds),
+        "members": sum(sizes),
+        "cached": sum(len(g.members) for g in state.guilds),
+        "held_mb": held,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "seconds": elapsed,
+    }
+
+
+def measure(low_memory, guilds, seed):
+    env = dict(os.environ)
+    # config refuses to import without it
+    env.setdefault("BOT_DEBUG", "0")
+    env["LOW_MEMORY"] = str(int(low_memory))
+    proc = subprocess.run(
+        [
+            sys.executable,
+            "-m",
+            "benchmarks.member_cache_memory",
+            "--child",
+            "--guilds",
+            str(guilds),
+            "--seed",
+            str(seed),
+        ],
+        cwd=ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(proc.stdout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--guilds", type=int, default=2500)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_child(args.guilds, args.seed)))
+        return 0
+
+    results = {
+        "default": measure(False, args.guilds, args.seed),
+        "LOW_MEMORY=1": measure(True, args.guilds, args.seed),
+    }
+    print(
+        f"{'mode':<14}{'servers':>9}{'members':>11}{'cached':>11}"
+        f"{'held MB':>10}{'peak RSS MB':>13}{'build s':>9}"
+    )
+    for mode, r in results.items():
+        print(
+            f"{mode:<14}{r['guilds']:>9}{r['members']:>11}{r['cached']:>11}"
+            f"{r['held_mb']:>10.1f}{r['peak_rss_mb']:>13.1f}{r['seconds']:>9.1f}"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
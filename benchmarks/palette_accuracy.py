@@ -0,0 +1,61 @@
+"""Compares the fast palette mode against the exact one.
+
+Run from the repository root:
+
+    python -m benchmarks.palette_accuracy [image ...]
+
+With no arguments every image in examples/ is used. For each image the
+CIEDE2000 distance between the exact and fast primary/secondary colours is
+printed along with the time each mode took.
+"""
+
+import sys
+import time
+from pathlib import Path
+
+import colour
+import numpy as np
+from skimage.color import rgb2lab
+
+from cogs.utils.album_art.decoder import decode_image
+from cogs.utils.dominant_colors import dominant_colors, dominant_colors_fast
+
+EXAMPLES = Path(__file__).resolve().parent.parent / "examples"
+
+
+def _delta_e(rgb1, rgb2):
+    lab = rgb2lab(np.array([[rgb1, rgb2]], dtype=np.uint8))[0]
+    return float(colour.difference.delta_E_CIE2000(lab[0], lab[1]))
+
+
+def _timed(fn, data):
+    start = time.perf_counter()
+    result = fn(data)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def main(paths):
+    paths = [Path(p) for p in paths] or sorted(EXAMPLES.glob("*.png"))
+
+    header = f"{'image':<28}{'exact ms':>10}{'fast ms':>10}{'dE primary':>12}{'dE secondary':>14}"
+    print(header)
+    print("-" * len(header))
+
+    worst = 0.0
+    for path in paths:
+        data = decode_image(path.read_bytes()).rgba
+        exact, exact_ms = _timed(dominant_colors, data)
+        fast, fast_ms = _timed(dominant_colors_fast, data)
+        de_primary = _delta_e(exact[0], fast[0])
+        de_secondary = _delta_e(exact[1], fast[1])
+        worst = max(worst, de_primary, de_secondary)
+        print(
+            f"{path.name:<28}{exact_ms:>10.1f}{fast_ms:>10.1f}"
+            f"{de_primary:>12.2f}{de_secondary:>14.2f}"
+        )
+
+    print(f"\nWorst delta-E: {worst:.2f}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
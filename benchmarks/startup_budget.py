@@ -0,0 +1,113 @@
+"""Checks how long the bot's modules take to import.
+
+Run from the repository root:
+
+    python -m benchmarks.startup_budget [--runs N] [--scale X]
+
+Every module is imported in a fresh interpreter, timed, and compared
+against its budget in milliseconds. The best of --runs attempts counts, and
+--scale multiplies every budget for slower machines. The heavy colour
+science backends must only load in render workers, so importing any of
+them from the modules below is an error whatever the timing. Exits with
+status 1 if any module is over budget or pulls in a forbidden backend.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Budgets are roughly twice what a warm import takes on a laptop
+BUDGETS_MS = {
+    "bot": 1200,
+    "cogs.fmi": 1000,
+    "cogs.owner": 600,
+    "cogs.countdown": 600,
+    "cogs.help": 700,
+    "cogs.utils.render_pool": 250,
+    "cogs.utils.dominant_colors": 400,
+    "cogs.utils.fmi_builder": 450,
+    "cogs.utils.fmi_text": 250,
+}
+
+# Only _init_worker in render_pool may import these
+FORBIDDEN = ("colour", "cv2", "skimage", "sklearn", "scipy")
+
+_CHILD = """
+import importlib, json, resource, sys, time
+start = time.perf_counter()
+importlib.import_module(sys.argv[1])
+elapsed = time.perf_counter() - start
+print(json.dumps({
+    "ms": elapsed * 1000,
+    "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "forbidden": [m for m in sys.argv[2:] if m in sys.modules],
+}))
+"""
+
+_OWN_IMPORTS = {"importlib", "json", "resource", "time"}
+
+
+def _heaviest(stderr, count=3):
+    """Returns the slowest top-level packages from -X importtime output,
+    leaving out the ones the measuring code imports itself."""
+    totals = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        name = name.strip()
+        if not cumulative.strip().isdigit() or "." in name or name in _OWN_IMPORTS:
+            continue
+        totals[name] = int(cumulative) / 1000
+    return sorted(totals.items(), key=lambda item: -item[1])[:count]
+
+
+def measure(module):
+    env = dict(os.environ)
+    # config refuses to import without it
+    env.setdefault("BOT_DEBUG", "0")
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _CHILD, module, *FORBIDDEN],
+        cwd=ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    result = json.loads(proc.stdout)
+    result["heaviest"] = _heaviest(proc.stderr)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--scale", type=float, default=1.0)
+    args = parser.parse_args()
+
+    failed = False
+    print(f"{'module':<30}{'ms':>8}{'budget':>8}{'rss MB':>8}  heaviest imports")
+    for module, budget in BUDGETS_MS.items():
+        budget *= args.scale
+        best = min((measure(module) for _ in range(args.runs)), key=lambda r: r["ms"])
+        heaviest = ", ".join(f"{name} {ms:.0f}ms" for name, ms in best["heaviest"])
+        print(
+            f"{module:<30}{best['ms']:>8.0f}{budget:>8.0f}{best['rss_mb']:>8.1f}  {heaviest}"
+        )
+        if best["ms"] > budget:
+            print(f"  over budget by {best['ms'] - budget:.0f}ms")
+            failed = True
+        if best["forbidden"]:
+            print(f"  imports {', '.join(best['forbidden'])} at load time")
+            failed = True
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
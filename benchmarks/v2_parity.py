@@ -0,0 +1,136 @@
+"""Checks that the batched dominant_colors_v2 scoring picks the same secondary
+colour as the original per-cluster loop, and times both.
+
+Run from the repository root:
+
+    python -m benchmarks.v2_parity [trials]
+
+Exits non-zero if any selection differs.
+"""
+
+import sys
+import time
+from pathlib import Path
+
+import colour
+import numpy as np
+from sklearn.cluster import KMeans
+
+from cogs.utils.album_art.decoder import decode_image
+from cogs.utils.dominant_colors import (
+    _pick_secondary_v2,
+    _sorted_by_share,
+    _to_lab_pixels,
+)
+
+EXAMPLES = Path(__file__).resolve().parent.parent / "examples"
+THRESHOLDS = (8, 0.02, 12)
+
+
+def _reference_pick(colors, percent, min_delta_e, min_percentage, min_chroma):
+    """The scoring loop dominant_colors_v2 used before it was vectorized."""
+
+    def lab_to_lch(color):
+        L, a, b = color
+        return L, np.sqrt(a**2 + b**2), (np.degrees(np.arctan2(b, a)) + 360) % 360
+
+    def hue_distance(h1, h2):
+        d = abs(h1 - h2)
+        return min(d, 360 - d)
+
+    def hue_density(target_h, hues, chromas, bandwidth=20):
+        dists = np.array([hue_distance(target_h, h) for h in hues])
+        return np.sum(np.exp(-((dists / bandwidth) ** 2)) * chromas)
+
+    primary = colors[0]
+    lch = [lab_to_lch(c) for c in colors]
+    hues = np.array([h for _, _, h in lch])
+    chromas = np.array([C for _, C, _ in lch])
+
+    candidates = []
+    for i in range(1, len(colors)):
+        if percent[i] < min_percentage:
+            continue
+        delta_e = colour.difference.delta_E_CIE2000(primary, colors[i])
+        if delta_e < min_delta_e:
+            continue
+        L, C, h = lch[i]
+        if C < min_chroma:
+            continue
+        score = (
+            0.30 * (delta_e / 50.0)
+            + 0.28 * np.tanh(C / 40)
+            + 0.12 * np.sqrt(percent[i])
+            + 0.05 * np.exp(-(((L - 55) / 25) ** 2))
+            + 0.15 * np.exp(-(((hue_distance(lch[0][2], h) - 150) / 40) ** 2))
+            + 0.10 * (1.0 / (1.0 + hue_density(h, hues, chromas)))
+        )
+        candidates.append((score, i))
+
+    if not candidates:
+        for i in range(1, len(colors)):
+            delta_e = colour.difference.delta_E_CIE2000(primary, colors[i])
+            if delta_e < min_delta_e:
+                continue
+            L, C, h = lch[i]
+            if C < min_chroma:
+                continue
+            candidates.append((0.5 * np.tanh(C / 40) + 0.5 * (delta_e / 50.0), i))
+
+    if not candidates:
+        fallback = [
+            (colour.difference.delta_E_CIE2000(primary, colors[i]), i)
+            for i in range(1, len(colors))
+        ]
+        return max(fallback, key=lambda x: x[0])[1] if fallback else 0
+
+    return max(candidates, key=lambda x: x[0])[1]
+
+
+def _random_clusters(rng, n):
+    colors = np.column_stack(
+        (rng.uniform(0, 100, n), rng.uniform(-80, 80, n), rng.uniform(-80, 80, n))
+    )
+    # Mix in near-grey clusters so the fallback passes are exercised too
+    grey = rng.random(n) < 0.4
+    colors[grey, 1:] *= 0.1
+    percent = np.sort(rng.dirichlet(np.ones(n) * 0.5))[::-1]
+    return colors, percent
+
+
+def _example_clusters(clusters):
+    for path in sorted(EXAMPLES.glob("*.png")):
+        img = _to_lab_pixels(decode_image(path.read_bytes()).rgba)
+        cluster = KMeans(n_clusters=clusters, tol=0.001, random_state=42).fit(img)
+        yield _sorted_by_share(cluster.cluster_centers_, cluster.labels_)
+
+
+def _time(fn, cases):
+    start = time.perf_counter()
+    picks = [fn(colors, percent, *THRESHOLDS) for colors, percent in cases]
+    return picks, (time.perf_counter() - start) * 1e6 / len(cases)
+
+
+def main(trials):
+    rng = np.random.default_rng(42)
+    mismatches = 0
+
+    for clusters in (5, 8, 12, 16):
+        cases = [_random_clusters(rng, clusters) for _ in range(trials)]
+        cases.extend(_example_clusters(clusters))
+
+        expected, reference_us = _time(_reference_pick, cases)
+        actual, batched_us = _time(_pick_secondary_v2, cases)
+        diff = sum(e != a for e, a in zip(expected, actual))
+        mismatches += diff
+
+        print(
+            f"clusters={clusters:<3} cases={len(cases):<6} mismatches={diff:<4} "
+            f"loop={reference_us:8.1f}us batched={batched_us:8.1f}us"
+        )
+
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000))
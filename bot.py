@@ -1,30 +1,125 @@
-import aiohttp
 import asyncpg
 import discord
 from discord.ext import commands
 import logging
+import os
 import config
+from cogs.utils.album_art.cache import ArtworkCache
+from cogs.utils.album_art.spotify import SpotifyClient
+from cogs.utils.avatar_cache import AvatarCache
+from cogs.utils.http_session import SessionStats, create_session
+from cogs.utils.log_queue import queue_handler
+from cogs.utils.lru import LRUCache
+from cogs.utils.metrics import Metrics, MetricsServer
+from cogs.utils.palette_cache import PaletteCache
+from cogs.utils.rate_limit import RateLimiter
+from cogs.utils.render_pool import RenderPool
+from cogs.utils.user_cache import UserCache
 
 log = logging.getLogger(__name__)
 
 
-class Cosmo(commands.Bot):
-    def __init__(self, cogs):
+class Cosmo(commands.AutoShardedBot):
+    """The bot, running ``shard_ids`` out of ``shard_count`` gateway shards
+    (all of Discord's recommended number when both are None).
+
+    In cluster mode the launcher starts ``clusters`` of these in separate
+    processes. Each one gets its own database pool, HTTP session and render
+    workers, and an equal share of the machine-wide budgets: CPU cores, the
+    Last.fm rate limit and the metrics port range.
+    """
+
+    def __init__(
+        self, cogs, shard_ids=None, shard_count=None, cluster_id=None, clusters=1
+    ):
         self.api_key = config.LASTFM_API_KEY
         self.user_agent = config.USER_AGENT
         self.spotify_client_id = config.SPOTIFY_CLIENT_ID
         self.spotify_client_secret = config.SPOTIFY_CLIENT_SECRET
         self.initial_cogs = cogs
+        self.cluster_id = cluster_id
+        self.clusters = clusters
+        self.low_memory = bool(config.LOW_MEMORY)
+        # Set up in setup_hook, which close() may follow after failing halfway
+        self.metrics_server = None
+        self.session = None
+        self.spotify = None
+        self.lastfm_limiter = None
+        self.render_pool = None
+        self.user_cache = None
 
         intents = discord.Intents(
             members=True, messages=True, guilds=True, message_content=True
         )
 
-        super().__init__(intents=intents, command_prefix=config.BOT_PREFIX)
+        options = {}
+        if self.low_memory:
+            # Members still come with their messages and mentions, and the
+            # converters ask the gateway for anyone else when needed
+            options["member_cache_flags"] = discord.MemberCacheFlags.none()
+            options["chunk_guilds_at_startup"] = False
+
+        super().__init__(
+            intents=intents,
+            command_prefix=config.BOT_PREFIX,
+            shard_ids=shard_ids,
+            shard_count=shard_count,
+            **options,
+        )
         super().remove_command("help")
 
     async def setup_hook(self):
-        self.session = aiohttp.ClientSession()
+        self.metrics = Metrics(slow_threshold=config.METRICS_SLOW_MS / 1000)
+        if config.METRICS_PORT:
+            self.metrics_server = MetricsServer(
+                self.metrics,
+                host=config.METRICS_HOST,
+                port=config.METRICS_PORT + (self.cluster_id or 0),
+            )
+            await self.metrics_server.start()
+        log_handler = queue_handler()
+        if log_handler is not None:
+            self.metrics.add_collector(log_handler.prometheus)
+
+        self.session_stats = SessionStats()
+        self.session = create_session(
+            self.session_stats,
+            limit=config.HTTP_LIMIT,
+            limit_per_host=config.HTTP_LIMIT_PER_HOST,
+            dns_ttl=config.HTTP_DNS_TTL,
+            keepalive=config.HTTP_KEEPALIVE,
+            timeout=config.HTTP_TIMEOUT,
+        )
+        self.lastfm_limiter = RateLimiter(
+            rate=config.LASTFM_RATE / self.clusters,
+            burst=max(1, config.LASTFM_BURST // self.clusters),
+            max_wait=config.LASTFM_MAX_WAIT,
+        )
+        self.metrics.add_collector(lambda: self.lastfm_limiter.prometheus("lastfm"))
+        self.spotify = SpotifyClient(
+            self.session, self.spotify_client_id, self.spotify_client_secret
+        )
+        self.spotify.start()
+        self.metrics.add_collector(self.spotify.prometheus)
+        self.artwork_cache = ArtworkCache(
+            max_bytes=config.ARTWORK_CACHE_MB * 1024 * 1024,
+            ttl=config.ARTWORK_CACHE_TTL,
+            negative_ttl=config.ARTWORK_NEGATIVE_TTL,
+            directory=config.ARTWORK_CACHE_DIR,
+        )
+        self.metrics.add_collector(self.artwork_cache.prometheus)
+        self.avatar_cache = AvatarCache(
+            self.session,
+            max_entries=config.AVATAR_CACHE_SIZE,
+            max_bytes=config.AVATAR_CACHE_MB * 1024 * 1024,
+        )
+        self.metrics.add_collector(self.avatar_cache.prometheus)
+        cores = os.cpu_count() or 1
+        workers = config.RENDER_WORKERS or max(1, cores // self.clusters)
+        self.render_pool = RenderPool(workers, config.COLOR_MODE, config.OUTPUT_PROFILE)
+        await self.render_pool.start()
+        self.render_cache = LRUCache(max_bytes=config.RENDER_CACHE_MB * 1024 * 1024)
+        self.metrics.add_collector(lambda: self.render_cache.prometheus("render"))
 
         try:
             self.db_pool = await asyncpg.create_pool(database="cosmo", user="postgres")
@@ -32,6 +127,15 @@ class Cosmo(commands.Bot):
             log.error(f"Failed to create db pool: {e}")
             raise e
 
+        self.user_cache = UserCache(self.db_pool, max_entries=config.USER_CACHE_SIZE)
+        await self.user_cache.start(preload=config.USER_CACHE_PRELOAD)
+        self.palette_cache = PaletteCache(
+            self.db_pool,
+            max_entries=config.PALETTE_CACHE_SIZE,
+            max_rows=config.PALETTE_CACHE_ROWS,
+        )
+        self.metrics.add_collector(self.palette_cache.prometheus)
+
         for cog in self.initial_cogs:
             try:
                 await self.load_extension(cog)
@@ -49,8 +153,22 @@ class Cosmo(commands.Bot):
             log.error("Error: ", exc_info=error)
 
     async def on_ready(self):
-        print("Ready!")
+        if self.cluster_id is None:
+            print("Ready!")
+        else:
+            print(f"Cluster {self.cluster_id} ready with shards {self.shard_ids}")
 
     async def close(self):
-        await self.session.close()
+        if self.spotify is not None:
+            self.spotify.close()
+        if self.lastfm_limiter is not None:
+            self.lastfm_limiter.close()
+        if self.session is not None:
+            await self.session.close()
+        if self.user_cache is not None:
+            await self.user_cache.close()
+        if self.render_pool is not None:
+            self.render_pool.shutdown()
+        if self.metrics_server is not None:
+            await self.metrics_server.close()
         await super().close()
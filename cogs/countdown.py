@@ -1,36 +1,34 @@
+import time
+
 from discord.ext import commands
-import asyncio
+
+from .utils.countdown_scheduler import CountdownScheduler
 
 
 class Countdown(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        self.scheduler = CountdownScheduler()
+
+    async def cog_unload(self):
+        self.scheduler.close()
 
     @commands.command(name="cd")
     @commands.cooldown(1, 10, commands.BucketType.guild)
     async def count(self, ctx):
-        msg = await ctx.send("10")
-        await asyncio.sleep(1)
-        for num in range(9, 0, -1):
-            try:
-                await msg.edit(content=num)
-                await asyncio.sleep(1)
-            except:
-                return
-        await msg.edit(content="Go!")
+        await self._start(ctx, 10)
 
     @commands.command(name="scd")
     @commands.cooldown(1, 5, commands.BucketType.guild)
     async def short_count(self, ctx):
-        msg = await ctx.send("5")
-        await asyncio.sleep(1)
-        for num in range(4, 0, -1):
-            try:
-                await msg.edit(content=num)
-                await asyncio.sleep(1)
-            except:
-                return
-        await msg.edit(content="Go!")
+        await self._start(ctx, 5)
+
+    async def _start(self, ctx, seconds):
+        # Ticks are timed from when the first message was sent rather than
+        # when it came back, so every edit lands as late as that message did
+        start = time.monotonic()
+        msg = await ctx.send(str(seconds))
+        self.scheduler.add(msg, seconds, start)
 
     @count.error
     async def count_error(self, ctx, error):
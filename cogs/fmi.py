@@ -1,6 +1,6 @@
 import asyncio
 import logging
-import typing
+import time
 from io import BytesIO
 from typing import NamedTuple
 
@@ -8,19 +8,37 @@ import aiohttp
 import discord
 from discord.ext import commands
 
+import config
+
 from .utils.album_art import get_album_image
-from .utils.album_art.fetcher import fetch_avatar_bytes
-from .utils.fmi_builder import FmiBuilder
-from .utils.fmi_text import FmiText
+from .utils.album_art.cache import album_key
+from .utils.lru import LRUCache
+from .utils.pages import LivePages
+from .utils.palette_cache import palette_key
+from .utils.prefetcher import NowPlayingPrefetcher
+from .utils.rate_limit import BULK, INTERACTIVE, RateLimitTimeout, Ticket
+from .utils.render_pool import render_key
+from .utils.singleflight import SingleFlight
 
 log = logging.getLogger(__name__)
 
+# Tries per Last.fm lookup while the API keeps answering "rate limited"
+_LASTFM_ATTEMPTS = 3
+
+
+def _parse_retry_after(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
 
 class LastFmParameters(NamedTuple):
     title: str
     artist: str
     album: str
     albumartlink: str
+    now_playing: bool = False
 
 
 class LastFMInfoError(commands.CommandError):
@@ -47,6 +65,16 @@ class ScrobbleMissingInfoError(commands.CommandError):
     pass
 
 
+class NoRegisteredMembersError(commands.CommandError):
+    pass
+
+
+class TooManyUsersError(commands.CommandError):
+    def __init__(self, limit, *args, **kwargs):
+        self.limit = limit
+        super().__init__(*args, **kwargs)
+
+
 class MentionedUserNotFound(commands.CommandError):
     def __init__(self, name, *args, **kwargs):
         self.name = name
@@ -56,14 +84,31 @@ class MentionedUserNotFound(commands.CommandError):
 class Fmi(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
+        self._recent_tracks = LRUCache(max_entries=10_000, ttl=config.LASTFM_CACHE_TTL)
+        # A lookup everyone gave up on (a timed out .listening check) would
+        # still hold a request slot and spend a token
+        self._lastfm_flight = SingleFlight(cancel_abandoned=True)
+        # The limiter ticket of each lookup in flight, by lowercased username
+        self._lastfm_tickets = {}
+        self.prefetcher = None
+        if config.PREFETCH_ENABLED and config.PREFETCH_CALLS_PER_MINUTE > 0:
+            self.prefetcher = NowPlayingPrefetcher(
+                self,
+                max_users=config.PREFETCH_MAX_USERS,
+                interval=config.PREFETCH_INTERVAL,
+                calls_per_minute=config.PREFETCH_CALLS_PER_MINUTE / bot.clusters,
+            )
+
+    async def cog_load(self):
+        if self.prefetcher is not None:
+            self.prefetcher.start()
+
+    async def cog_unload(self):
+        if self.prefetcher is not None:
+            self.prefetcher.stop()
 
     async def find_user(self, discord_id):
-        query = "SELECT username FROM discord WHERE id = $1;"
-        async with self.bot.db_pool.acquire() as connection:
-            row = await connection.fetchrow(query, discord_id)
-            if row:
-                return row.get("username")
-            return None
+        return await self.bot.user_cache.get(discord_id)
 
     @commands.command(name="set")
     async def register(self, ctx, lastfm_username: str):
@@ -76,11 +121,13 @@ class Fmi(commands.Cog):
                     await connection.execute(
                         query, ctx.message.author.id, lastfm_username
                     )
-                    await ctx.send(
-                        "{}'s Last.fm account has been set.".format(
-                            ctx.message.author.display_name
-                        )
-                    )
+                    await self.bot.user_cache.notify(connection, ctx.message.author.id)
+            self.bot.user_cache.put(ctx.message.author.id, lastfm_username)
+            await ctx.send(
+                "{}'s Last.fm account has been set.".format(
+                    ctx.message.author.display_name
+                )
+            )
         except Exception:
             log.exception(
                 "Failed to add/update last.fm username for user %s",
@@ -90,21 +137,35 @@ class Fmi(commands.Cog):
 
     @commands.command(name="fmi")
     @commands.cooldown(3, 10, commands.BucketType.user)
-    async def fmi(self, ctx, other_user: typing.Optional[discord.Member] = None):
-        if other_user:
-            lastfm_username = await self.find_user(other_user.id)
-            if lastfm_username is None:
-                raise MentionedUserNotFound(other_user.display_name)
-            avatar_url = str(other_user.avatar.replace(format="png", size=128))
-        else:
-            lastfm_username = await self.find_user(ctx.message.author.id)
-            if lastfm_username is None:
-                raise UserNotFound
-            avatar_url = str(ctx.author.avatar.replace(format="png", size=128))
-
-        last_fm_info = await self._get_lastfm_info(lastfm_username)
-        image = await self._generate_fmi(last_fm_info, avatar_url)
-        await ctx.send(file=discord.File(image, "fmi.png"))
+    async def fmi(self, ctx, others: commands.Greedy[discord.Member]):
+        others = list(dict.fromkeys(others))
+        if len(others) > 1:
+            return await self._fmi_many(ctx, others)
+        other_user = others[0] if others else None
+
+        with self.bot.metrics.trace("fmi") as trace:
+            if other_user:
+                with trace.span("find_user"):
+                    lastfm_username = await self.find_user(other_user.id)
+                if lastfm_username is None:
+                    raise MentionedUserNotFound(other_user.display_name)
+                avatar = other_user.avatar or other_user.default_avatar
+            else:
+                with trace.span("find_user"):
+                    lastfm_username = await self.find_user(ctx.message.author.id)
+                if lastfm_username is None:
+                    raise UserNotFound
+                avatar = ctx.author.avatar or ctx.author.default_avatar
+
+            if self.prefetcher is not None:
+                self.prefetcher.touch(lastfm_username)
+
+            with trace.span("lastfm_info"):
+                last_fm_info = await self._get_lastfm_info(lastfm_username)
+            image = await self._generate_fmi(last_fm_info, avatar, trace)
+            with trace.span("send"):
+                filename = f"fmi.{self.bot.render_pool.extension}"
+                await ctx.send(file=discord.File(image, filename))
 
     @fmi.error
     async def fmi_error(self, ctx, error):
@@ -134,6 +195,10 @@ class Fmi(commands.Cog):
             await ctx.send(
                 "We can't get that album artwork right now, try again in a few minutes."
             )
+        elif isinstance(error, TooManyUsersError):
+            await ctx.send(
+                "You can mention up to {} members at once.".format(error.limit)
+            )
         elif isinstance(error, NoScrobblesFoundError):
             await ctx.send("No scrobbles found.")
         elif isinstance(error, commands.CommandOnCooldown):
@@ -142,7 +207,179 @@ class Fmi(commands.Cog):
             await ctx.send("Something went wrong...")
             log.error("Error: ", exc_info=error)
 
-    async def _get_lastfm_info(self, lastfm_username):
+    async def _fmi_many(self, ctx, members):
+        """Renders one stacked image for several members, skipping the ones
+        that can't be rendered rather than failing the whole command."""
+        if len(members) > config.FMI_MAX_USERS:
+            raise TooManyUsersError(config.FMI_MAX_USERS)
+
+        with self.bot.metrics.trace("fmi_multi") as trace:
+            with trace.span("find_user"):
+                usernames = await self.bot.user_cache.get_many(
+                    [member.id for member in members]
+                )
+
+            skipped = []
+            limit = asyncio.Semaphore(config.FMI_CONCURRENCY)
+
+            async def lastfm_info(member):
+                async with limit:
+                    try:
+                        return await self._get_lastfm_info(usernames[member.id])
+                    except commands.CommandError:
+                        return None
+
+            registered = []
+            for member in members:
+                if usernames[member.id] is None:
+                    skipped.append(f"{member.display_name} (not connected)")
+                else:
+                    registered.append(member)
+
+            with trace.span("lastfm_info"):
+                infos = await asyncio.gather(*(lastfm_info(m) for m in registered))
+
+            entries = []
+            for member, info in zip(registered, infos):
+                if info is None:
+                    skipped.append(f"{member.display_name} (no recent scrobble)")
+                else:
+                    entries.append((member, info))
+
+            image = None
+            if entries:
+                image = await self._generate_stacked_fmi(entries, limit, skipped, trace)
+
+            if image is None:
+                await ctx.send("Couldn't make an fmi for " + ", ".join(skipped) + ".")
+                return
+
+            content = "Skipped " + ", ".join(skipped) + "." if skipped else None
+            with trace.span("send"):
+                filename = f"fmi.{self.bot.render_pool.extension}"
+                await ctx.send(content, file=discord.File(image, filename))
+
+    @commands.command(name="listening", aliases=["wl"])
+    @commands.guild_only()
+    @commands.cooldown(1, 30, commands.BucketType.guild)
+    @commands.max_concurrency(1, commands.BucketType.guild)
+    async def listening(self, ctx):
+        """Lists what every registered member of the guild is playing now."""
+        if ctx.guild.chunked:
+            members = ctx.guild.members
+        else:
+            # LOW_MEMORY doesn't cache members, so fetch them just for this call
+            members = await ctx.guild.chunk(cache=False)
+        members = [member for member in members if not member.bot]
+        usernames = await self.bot.user_cache.get_many(
+            [member.id for member in members], remember_missing=False
+        )
+        registered = [(m, usernames[m.id]) for m in members if usernames[m.id]]
+        if not registered:
+            raise NoRegisteredMembersError
+
+        pages = LivePages(ctx.author.id, f"Listening now in {ctx.guild.name}")
+        await pages.start(ctx)
+
+        limit = asyncio.Semaphore(config.LISTENING_CONCURRENCY)
+
+        async def check(member, username):
+            async with limit:
+                try:
+                    info = await asyncio.wait_for(
+                        # Only title and artist are listed, so tracks
+                        # without artwork count too
+                        self._get_lastfm_info(username, BULK, require_art=False),
+                        config.LISTENING_TIMEOUT,
+                    )
+                except (commands.CommandError, asyncio.TimeoutError):
+                    info = None
+            return member, info
+
+        tasks = [asyncio.ensure_future(check(m, u)) for m, u in registered]
+        checked = listening = 0
+        try:
+            for next_result in asyncio.as_completed(tasks):
+                member, info = await next_result
+                checked += 1
+                if info is not None and info.now_playing:
+                    listening += 1
+                    pages.add(
+                        "**{}**: {} by {}".format(
+                            discord.utils.escape_markdown(member.display_name),
+                            discord.utils.escape_markdown(info.title[:80]),
+                            discord.utils.escape_markdown(info.artist[:80]),
+                        )
+                    )
+                pages.set_footer(
+                    f"{listening} listening, checked {checked}/{len(registered)}"
+                )
+        finally:
+            for task in tasks:
+                task.cancel()
+            await pages.finish()
+
+    @listening.error
+    async def listening_error(self, ctx, error):
+        if isinstance(error, NoRegisteredMembersError):
+            await ctx.send("Nobody here has connected their Last.fm account yet.")
+        elif isinstance(error, commands.CommandOnCooldown):
+            await ctx.send("That was checked just now, try again in a bit.")
+        elif isinstance(error, commands.MaxConcurrencyReached):
+            await ctx.send("Already checking this server, hang on.")
+        elif isinstance(error, commands.NoPrivateMessage):
+            await ctx.send("That only works in a server.")
+        else:
+            await ctx.send("Something went wrong...")
+            log.error("Error: ", exc_info=error)
+
+    async def _get_lastfm_info(
+        self, lastfm_username, priority=INTERACTIVE, require_art=True
+    ):
+        """Returns the user's most recent scrobble. Unless ``require_art`` is
+        False, one without an album name or artwork link raises
+        ScrobbleMissingInfoError, as it can't be rendered."""
+        # Last.fm usernames are case insensitive
+        key = lastfm_username.casefold()
+        lastfmdata = self._recent_tracks.get(key)
+        if lastfmdata is None:
+            lastfmdata = await self._lookup_lastfm_info(lastfm_username, key, priority)
+        if require_art and not (lastfmdata.album and lastfmdata.albumartlink):
+            raise ScrobbleMissingInfoError
+        return lastfmdata
+
+    async def _lookup_lastfm_info(self, lastfm_username, key, priority):
+        ticket = self._lastfm_tickets.get(key)
+        if ticket is None:
+            ticket = self._lastfm_tickets[key] = Ticket(priority)
+        else:
+            # Joining a lookup started by .listening or the prefetcher must
+            # not leave a .fmi waiting behind their whole queue
+            self.bot.lastfm_limiter.promote(ticket, priority)
+        lastfmdata = await self._lastfm_flight.do(
+            key, self._fetch_lastfm_info, lastfm_username, key, ticket
+        )
+        self._recent_tracks.put(key, lastfmdata)
+        return lastfmdata
+
+    def lastfm_stats(self):
+        cache_hits = self._recent_tracks.hits
+        coalesced = self._lastfm_flight.shared
+        return {
+            "upstream_calls": self._lastfm_flight.calls,
+            "cache_hits": cache_hits,
+            "coalesced": coalesced,
+            "saved": cache_hits + coalesced,
+        }
+
+    async def _fetch_lastfm_info(self, lastfm_username, key, ticket):
+        try:
+            return await self._request_lastfm_info(lastfm_username, ticket)
+        finally:
+            if self._lastfm_tickets.get(key) is ticket:
+                del self._lastfm_tickets[key]
+
+    async def _request_lastfm_info(self, lastfm_username, ticket):
         params = {
             "method": "user.getrecenttracks",
             "limit": 1,
@@ -153,17 +390,40 @@ class Fmi(commands.Cog):
         headers = {"User-Agent": self.bot.user_agent}
         url = "https://ws.audioscrobbler.com/2.0/"
 
-        try:
-            async with self.bot.session.get(
-                url, headers=headers, params=params
-            ) as resp:
-                if resp.status != 200:
-                    raise LastFMInfoError
-                js = await resp.json()
-        except LastFMInfoError:
-            raise
-        except (aiohttp.ClientError, asyncio.TimeoutError):
-            log.exception("Failed to contact Last.fm for user %s", lastfm_username)
+        limiter = self.bot.lastfm_limiter
+        for _ in range(_LASTFM_ATTEMPTS):
+            try:
+                await limiter.acquire(ticket=ticket)
+            except RateLimitTimeout:
+                log.warning(
+                    "No Last.fm request slot in time for user %s", lastfm_username
+                )
+                raise LastFMInfoError
+
+            try:
+                async with self.bot.session.get(
+                    url, headers=headers, params=params
+                ) as resp:
+                    status = resp.status
+                    retry_after = resp.headers.get("Retry-After")
+                    try:
+                        js = await resp.json(content_type=None)
+                    except ValueError:
+                        js = None
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                log.exception("Failed to contact Last.fm for user %s", lastfm_username)
+                raise LastFMInfoError
+
+            # Error 29 is Last.fm's "Rate Limit Exceeded", on any status code
+            if status == 429 or (isinstance(js, dict) and js.get("error") == 29):
+                limiter.backoff(_parse_retry_after(retry_after))
+                continue
+            if status != 200 or not isinstance(js, dict):
+                raise LastFMInfoError
+            limiter.success()
+            break
+        else:
+            log.warning("Still rate limited by Last.fm for user %s", lastfm_username)
             raise LastFMInfoError
 
         try:
@@ -189,9 +449,12 @@ class Fmi(commands.Cog):
                 artist=artist,
                 album=album,
                 albumartlink=albumartlink,
+                now_playing=(track.get("@attr") or {}).get("nowplaying") == "true",
             )
 
-            if not all(lastfmdata):
+            # Album and artwork are often missing for singles and local files,
+            # which is checked by the callers that need them
+            if not (title and artist):
                 raise ScrobbleMissingInfoError
 
             return lastfmdata
@@ -210,49 +473,172 @@ class Fmi(commands.Cog):
                 artist,
                 album,
                 lastfm_url,
-                self.bot.spotify_client_id,
-                self.bot.spotify_client_secret,
+                self.bot.spotify,
+                self.bot.artwork_cache,
             )
         except Exception as e:
             log.exception("Error getting album art for %s / %s: %s", artist, album, e)
             return None
 
-    async def _fetch_avatar(self, avatar_url):
+    async def _fetch_avatar(self, avatar):
         try:
-            avatar_bytes = await fetch_avatar_bytes(self.bot.session, avatar_url)
-            if avatar_bytes:
-                return BytesIO(avatar_bytes)
-            return None
+            return await self.bot.avatar_cache.get(avatar)
         except Exception as e:
             log.exception("Error fetching avatar: %s", e)
             return None
 
-    async def _generate_fmi(self, lastfmdata, avatar_url):
-        album_task = self._get_album_art(
-            artist=lastfmdata.artist,
-            album=lastfmdata.album,
-            lastfm_url=lastfmdata.albumartlink,
-        )
+    async def _generate_fmi(self, lastfmdata, avatar, trace):
+        async def album_task():
+            with trace.span("album_art") as span:
+                album = await self._get_album_art(
+                    artist=lastfmdata.artist,
+                    album=lastfmdata.album,
+                    lastfm_url=lastfmdata.albumartlink,
+                )
+                span.labels["source"] = album.source if album else "none"
+            return album
 
-        avatar_task = self._fetch_avatar(avatar_url)
+        async def avatar_task():
+            with trace.span("avatar"):
+                return await self._fetch_avatar(avatar)
 
-        album_result, avatar_result = await asyncio.gather(album_task, avatar_task)
+        album_result, avatar_result = await asyncio.gather(album_task(), avatar_task())
 
-        album_bytes_io = album_result
-        if album_bytes_io is None:
+        album = album_result
+        if album is None:
             log.error(
                 "Album art not found for %s / %s", lastfmdata.artist, lastfmdata.album
             )
             raise AlbumArtError()
 
-        avatar_bytes = avatar_result
-        if avatar_bytes is None:
+        avatar_tile = avatar_result
+        if avatar_tile is None:
             raise AvatarNotFoundError()
 
-        text = FmiText(lastfmdata)
-        image = FmiBuilder(album_bytes_io, avatar_bytes, text).create_fmi()
+        color_mode = self.bot.render_pool.color_mode
+        cache_key = render_key(
+            lastfmdata,
+            album.digest,
+            avatar.key,
+            color_mode,
+            self.bot.render_pool.output_profile,
+        )
+        image = self.bot.render_cache.get(cache_key)
+        if image is not None:
+            return BytesIO(image)
+
+        key = palette_key(album.digest, color_mode)
+        with trace.span("palette_lookup"):
+            palette = await self.bot.palette_cache.get(key)
+
+        start = time.perf_counter()
+        result = await self.bot.render_pool.render(
+            album, avatar_tile, lastfmdata, palette
+        )
+        elapsed = time.perf_counter() - start
+        for stage, seconds in result.timings.items():
+            trace.add(stage, seconds)
+        # Waiting for a free worker plus pickling the arguments and result
+        trace.add("render_overhead", max(0.0, elapsed - sum(result.timings.values())))
+
+        if palette is None:
+            await self.bot.palette_cache.put(key, result.palette)
+        self.bot.render_cache.put(cache_key, result.image)
+
+        return BytesIO(result.image)
+
+    async def _generate_stacked_fmi(self, entries, limit, skipped, trace):
+        """entries is a list of (member, lastfmdata). Members whose artwork or
+        avatar can't be fetched are added to skipped. Returns None if no card
+        is left to render."""
+
+        async def album_art(lastfmdata):
+            async with limit:
+                return await self._get_album_art(
+                    artist=lastfmdata.artist,
+                    album=lastfmdata.album,
+                    lastfm_url=lastfmdata.albumartlink,
+                )
+
+        async def avatar_tile(member):
+            async with limit:
+                return await self._fetch_avatar(member.avatar or member.default_avatar)
+
+        # Listening parties share albums, fetch each one once
+        albums = {}
+        for _, lastfmdata in entries:
+            albums.setdefault(
+                album_key(lastfmdata.artist, lastfmdata.album), lastfmdata
+            )
+
+        async def all_album_art():
+            with trace.span("album_art"):
+                return await asyncio.gather(*(album_art(i) for i in albums.values()))
+
+        async def all_avatars():
+            with trace.span("avatar"):
+                return await asyncio.gather(*(avatar_tile(m) for m, _ in entries))
+
+        fetched, tiles = await asyncio.gather(all_album_art(), all_avatars())
+        fetched = dict(zip(albums, fetched))
+
+        color_mode = self.bot.render_pool.color_mode
+        cards = []
+        keys = []
+        for (member, lastfmdata), tile in zip(entries, tiles):
+            album = fetched[album_key(lastfmdata.artist, lastfmdata.album)]
+            if album is None:
+                skipped.append(f"{member.display_name} (no album artwork)")
+            elif tile is None:
+                skipped.append(f"{member.display_name} (avatar unavailable)")
+            else:
+                cards.append([album, tile, lastfmdata, None])
+                keys.append(
+                    render_key(
+                        lastfmdata,
+                        album.digest,
+                        (member.avatar or member.default_avatar).key,
+                        color_mode,
+                        self.bot.render_pool.output_profile,
+                    )
+                )
+        if not cards:
+            return None
+
+        cache_key = ("stack", *keys)
+        image = self.bot.render_cache.get(cache_key)
+        if image is not None:
+            return BytesIO(image)
+
+        digests = list(dict.fromkeys(card[0].digest for card in cards))
+        with trace.span("palette_lookup"):
+            palettes = await asyncio.gather(
+                *(
+                    self.bot.palette_cache.get(palette_key(digest, color_mode))
+                    for digest in digests
+                )
+            )
+        palettes = dict(zip(digests, palettes))
+        for card in cards:
+            card[3] = palettes[card[0].digest]
+
+        start = time.perf_counter()
+        result = await self.bot.render_pool.render_stack([tuple(c) for c in cards])
+        elapsed = time.perf_counter() - start
+        for stage, seconds in result.timings.items():
+            trace.add(stage, seconds)
+        trace.add("render_overhead", max(0.0, elapsed - sum(result.timings.values())))
+
+        for card, palette in zip(cards, result.palette):
+            digest = card[0].digest
+            if palettes[digest] is None:
+                palettes[digest] = palette
+                await self.bot.palette_cache.put(
+                    palette_key(digest, color_mode), palette
+                )
+        self.bot.render_cache.put(cache_key, result.image)
 
-        return image
+        return BytesIO(result.image)
 
 
 async def setup(bot):
@@ -12,7 +12,12 @@ class Help(commands.Cog):
         embed.add_field(name=".cd", value="Countdown for listening parties.")
         embed.add_field(
             name=".fmi",
-            value="Outputs formatted image of currently playing last.fm song",
+            value="Outputs formatted image of currently playing last.fm song. "
+            '".fmi @user1 @user2" stacks several members into one image',
+        )
+        embed.add_field(
+            name=".listening",
+            value="Lists what everyone in the server is listening to right now",
         )
         embed.add_field(
             name=".set",
@@ -1,5 +1,7 @@
 # Based on gist from EvieePy https://gist.github.com/EvieePy/d78c061a4798ae81be9825468fe146be#file-owner-py
 
+from collections import Counter
+
 import discord
 from discord.ext import commands
 
@@ -13,10 +15,117 @@ class OwnerCog(commands.Cog):
     async def servers(self, ctx):
         """Command which shows the total amount of server and users"""
         guilds = len(self.bot.guilds)
-        users = sum([len([m for m in g.members if not m.bot]) for g in self.bot.guilds])
+        if self.bot.low_memory:
+            # Members aren't cached, so use the counts Discord keeps, bots included
+            users = sum(g.member_count or 0 for g in self.bot.guilds)
+            label = "Total members (approximate)"
+        else:
+            users = sum(
+                [len([m for m in g.members if not m.bot]) for g in self.bot.guilds]
+            )
+            label = "Total users"
+
+        embed = discord.Embed()
+        embed.description = f"**Total servers:** {guilds}\n**{label}:** {users}"
+
+        await ctx.send(embed=embed, delete_after=30)
+
+    @commands.command(name="shards", hidden=True)
+    @commands.is_owner()
+    async def shards(self, ctx):
+        """Command which shows the shards run by this process"""
+        guilds = Counter(g.shard_id for g in self.bot.guilds)
+        lines = [
+            f"**Shard {shard_id}**: {guilds[shard_id]} servers, "
+            f"{shard.latency * 1000:.0f}ms"
+            for shard_id, shard in sorted(self.bot.shards.items())
+        ]
+
+        embed = discord.Embed()
+        embed.description = "\n".join(lines)
+        if self.bot.cluster_id is not None:
+            embed.title = f"Cluster {self.bot.cluster_id} of {self.bot.clusters}"
+        embed.set_footer(text=f"{self.bot.shard_count} shards in total")
+
+        await ctx.send(embed=embed, delete_after=30)
+
+    @commands.command(name="http", hidden=True)
+    @commands.is_owner()
+    async def http_stats(self, ctx):
+        """Command which shows connection pool stats per host"""
+        stats = self.bot.session_stats.snapshot(self.bot.session.connector)
+        lines = [
+            f"**{host}**: {s['requests']} req, {s['active']} active / {s['idle']} idle, "
+            f"reuse {s['reuse_ratio']:.0%}, queued {s['queued']} "
+            f"(avg {s['avg_wait_ms']:.1f}ms, max {s['max_wait_ms']:.1f}ms)"
+            for host, s in stats.items()
+        ]
+
+        embed = discord.Embed()
+        embed.description = "\n".join(lines) or "No requests yet."
+
+        await ctx.send(embed=embed, delete_after=30)
+
+    @commands.command(name="lastfm", hidden=True)
+    @commands.is_owner()
+    async def lastfm_stats(self, ctx):
+        """Command which shows the Last.fm rate limiter queue"""
+        stats = self.bot.lastfm_limiter.stats()
+        lines = [
+            f"**Queued:** {stats['queued']} now, {stats['max_queued']} max",
+            f"**Throttled by Last.fm:** {stats['throttled']}, "
+            f"paused for {stats['paused_for']:.1f}s",
+            f"**Gave up waiting:** {stats['timeouts']}",
+        ]
+        lines += [
+            f"**{name} wait:** {w['count']}x, p50 {w['p50_ms']:.1f}ms, "
+            f"p95 {w['p95_ms']:.1f}ms"
+            for name, w in stats["waits"].items()
+        ]
+        fmi = self.bot.get_cog("Fmi")
+        if fmi is not None:
+            lookups = fmi.lastfm_stats()
+            lines.append(
+                f"**Lookups:** {lookups['upstream_calls']} sent, "
+                f"{lookups['cache_hits']} cached, {lookups['coalesced']} coalesced "
+                f"({lookups['saved']} requests saved)"
+            )
+        if fmi is not None and fmi.prefetcher is not None:
+            prefetch = fmi.prefetcher.stats()
+            lines.append(
+                f"**Prefetch:** watching {prefetch['watched']}, "
+                f"{prefetch['polls']} polls, {prefetch['prefetches']} prefetched"
+            )
+
+        embed = discord.Embed()
+        embed.description = "\n".join(lines)
+
+        await ctx.send(embed=embed, delete_after=30)
+
+    @commands.command(name="latency", hidden=True)
+    @commands.is_owner()
+    async def latency(self, ctx):
+        """Command which shows per-stage .fmi timings since startup"""
+        summary = self.bot.metrics.summary("fmi")
+        lines = [
+            f"**{stage}**{''.join(f' {v}' for _, v in labels)}: {s['count']}x, "
+            f"avg {s['avg_ms']:.1f}ms, p50 {s['p50_ms']:.1f}ms, p95 {s['p95_ms']:.1f}ms"
+            for (stage, labels), s in summary.items()
+        ]
 
         embed = discord.Embed()
-        embed.description = f"**Total servers:** {guilds}\n**Total users:** {users}"
+        embed.description = "\n".join(lines) or "No requests yet."
+        layout = self.bot.render_pool.layout_stats()
+        output = self.bot.render_pool.output_stats()
+        renders = self.bot.render_cache.stats()
+        embed.set_footer(
+            text=f"Text layout cache: {layout['hit_rate']:.0%} hits, "
+            f"{layout['entries']} entries over {layout['workers']} workers\n"
+            f"Render cache: {renders['hit_rate']:.0%} hits, "
+            f"{renders['entries']} images in {renders['bytes'] / 1024 / 1024:.1f}MB\n"
+            f"Output {output['profile']}: avg {output['avg_kb']:.1f}KB, "
+            f"encoded in {output['avg_encode_ms']:.1f}ms"
+        )
 
         await ctx.send(embed=embed, delete_after=30)
 
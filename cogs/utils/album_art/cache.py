@@ -0,0 +1,186 @@
+import asyncio
+import hashlib
+import logging
+import os
+import time
+
+from ..lru import LRUCache
+
+log = logging.getLogger(__name__)
+
+# Stored for albums that are known to have no artwork anywhere
+NO_ART = b""
+
+
+def album_key(artist, album):
+    def normalize(s):
+        return " ".join(s.casefold().split())
+
+    return f"album:{normalize(artist)}\x1f{normalize(album)}"
+
+
+def url_key(url):
+    return f"url:{url}"
+
+
+# A disk file starting with this names the key holding the actual bytes
+_ALIAS_PREFIX = b"\0alias:"
+
+
+def _sizeof(value):
+    # Aliases are a short key, nothing next to the artwork they point at
+    return 0 if isinstance(value, str) else len(value)
+
+
+class ArtworkCache:
+    """Two tier cache of raw album artwork bytes.
+
+    The first tier is an LRU bounded by total bytes. The optional second tier
+    stores one file per key in ``directory``, which survives restarts and is
+    shared between bot processes on the same machine. A hit returns the image
+    bytes, NO_ART for a cached miss, or None when nothing is cached.
+
+    The bytes are stored once under their SHA-1 and every key put with them
+    is an alias to that copy, so an album and its artwork URL (or albums
+    sharing artwork) don't use up the size bound several times over.
+    """
+
+    def __init__(
+        self,
+        max_bytes=64 * 1024 * 1024,
+        ttl=7 * 24 * 3600,
+        negative_ttl=6 * 3600,
+        directory=None,
+        disk_max_bytes=1024 * 1024 * 1024,
+    ):
+        # The entry bound only matters for NO_ART entries, which have no size
+        self._memory = LRUCache(
+            max_entries=100_000, max_bytes=max_bytes, ttl=ttl, sizeof=_sizeof
+        )
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.directory = directory
+        self.disk_max_bytes = disk_max_bytes
+        self.disk_hits = 0
+        self._disk_writes = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    async def get(self, key):
+        data = await self._lookup(key)
+        if isinstance(data, str):
+            data = await self._lookup(data, count=False)
+            # The bytes may have been evicted before the alias
+            if isinstance(data, str):
+                data = None
+        return data
+
+    async def _lookup(self, key, count=True):
+        data = self._memory.get(key, count=count)
+        if data is not None or not self.directory:
+            return data
+
+        data = await asyncio.to_thread(self._read_disk, key)
+        if data is not None:
+            self.disk_hits += 1
+            self._memory.put(key, data, ttl=self._ttl_for(data))
+        return data
+
+    async def put(self, key, data):
+        if data == NO_ART:
+            await self._store(key, data)
+            return
+
+        blob = "blob:" + hashlib.sha1(data).hexdigest()
+        # Refresh its TTL, but only write the file the first time round
+        await self._store(blob, data, write=blob not in self._memory)
+        await self._store(key, blob)
+
+    async def _store(self, key, data, write=True):
+        self._memory.put(key, data, ttl=self._ttl_for(data))
+        if self.directory and write:
+            await asyncio.to_thread(self._write_disk, key, data)
+
+    async def put_negative(self, key):
+        await self.put(key, NO_ART)
+
+    def _ttl_for(self, data):
+        return self.negative_ttl if data == NO_ART else self.ttl
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest())
+
+    def _read_disk(self, key):
+        path = self._path(key)
+        try:
+            stat = os.stat(path)
+            ttl = self.negative_ttl if stat.st_size == 0 else self.ttl
+            if time.time() - stat.st_mtime > ttl:
+                os.remove(path)
+                return None
+            with open(path, "rb") as f:
+                data = f.read()
+            if data.startswith(_ALIAS_PREFIX):
+                return data[len(_ALIAS_PREFIX) :].decode()
+            return data
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            log.warning("Failed to read cached artwork %s: %s", path, e)
+            return None
+
+    def _write_disk(self, key, data):
+        path = self._path(key)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        if isinstance(data, str):
+            data = _ALIAS_PREFIX + data.encode()
+        try:
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except OSError as e:
+            log.warning("Failed to write cached artwork %s: %s", path, e)
+            return
+
+        self._disk_writes += 1
+        if self._disk_writes % 100 == 0:
+            self._prune_disk()
+
+    def _prune_disk(self):
+        """Deletes expired files, then the oldest files beyond disk_max_bytes."""
+        now = time.time()
+        files = []
+        for entry in os.scandir(self.directory):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            ttl = self.negative_ttl if stat.st_size == 0 else self.ttl
+            if now - stat.st_mtime > ttl:
+                self._remove(entry.path)
+            else:
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.disk_max_bytes:
+                break
+            self._remove(path)
+            total -= size
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def stats(self):
+        return {**self._memory.stats(), "disk_hits": self.disk_hits}
+
+    def prometheus(self):
+        """Returns the cache's metrics in Prometheus text format, for
+        Metrics.add_collector."""
+        return self._memory.prometheus("artwork") + [
+            "# TYPE cosmo_artwork_cache_disk_hits_total counter",
+            f"cosmo_artwork_cache_disk_hits_total {self.disk_hits}",
+        ]
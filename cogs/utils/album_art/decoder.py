@@ -1,32 +1,67 @@
+import hashlib
 import logging
 from io import BytesIO
 
+import numpy as np
 from PIL import Image
 
 log = logging.getLogger(__name__)
 
 
+class DecodedImage:
+    """A decoded image shared by the colour engine and the compositor.
+
+    Pixels are held once as an RGBA ndarray. ``rgb`` and ``image`` are views
+    of that array, so neither numpy nor PIL consumers copy or decode again.
+    ``digest`` identifies the original encoded bytes for caching, ``source``
+    records where they were fetched from.
+    """
+
+    def __init__(self, rgba, digest, source=None):
+        self.rgba = rgba
+        self.digest = digest
+        self.source = source
+
+    @property
+    def size(self):
+        return self.rgba.shape[1], self.rgba.shape[0]
+
+    @property
+    def rgb(self):
+        return self.rgba[..., :3]
+
+    @property
+    def image(self):
+        # RGBA is one of the modes PIL can map directly onto a buffer
+        return Image.frombuffer("RGBA", self.size, self.rgba, "raw", "RGBA", 0, 1)
+
+
 def validate_image_bytes(data):
+    """Checks that downloaded bytes are a complete image before they are
+    cached. JPEGs are decoded at reduced scale, which still reads the whole
+    stream, so truncated downloads are caught as well as error pages."""
     try:
-        bio = BytesIO(data)
-        with Image.open(bio) as img:
-            img.verify()
+        with Image.open(BytesIO(data)) as img:
+            img.draft(img.mode, (64, 64))
+            img.load()
         return True
     except Exception as e:
         log.warning("Image validation failed: %s", e)
         return False
 
 
-def decode_image_from_bytes(data):
+def decode_image(data, source=None):
+    """Decodes image bytes into a DecodedImage. Raises if the data is not a
+    complete, readable image, so no separate validation pass is needed."""
     try:
-        bio = BytesIO(data)
-        with Image.open(bio) as img:
+        with Image.open(BytesIO(data)) as img:
             img.load()
-            output = BytesIO()
-            img.save(output, format="PNG")
-            output.seek(0)
-            log.debug("Successfully decoded and converted image to PNG BytesIO")
-            return output
+            if img.mode != "RGBA":
+                img = img.convert("RGBA")
+            rgba = np.asarray(img)
     except Exception as e:
-        log.exception("Failed to decode image from bytes: %s", e)
+        log.warning("Failed to decode image from bytes: %s", e)
         raise
+
+    digest = hashlib.sha256(data).hexdigest()
+    return DecodedImage(rgba, digest, source)
@@ -1,125 +1,85 @@
 import asyncio
 import logging
-import time
 
 import aiohttp
 
-log = logging.getLogger(__name__)
+from .cache import NO_ART, album_key, url_key
+from .decoder import validate_image_bytes
 
-_spotify_token: str | None = None
-_spotify_token_expires: float = 0.0
+log = logging.getLogger(__name__)
 
 # Last.fm serves this hash as the URL when no real art exists
 _LASTFM_PLACEHOLDER = "2a96cbd8b46e442fc41c2b86b821562f"
 
 _LASTFM_TIMEOUT = aiohttp.ClientTimeout(sock_connect=3, total=8)
-_SPOTIFY_API_TIMEOUT = aiohttp.ClientTimeout(total=5)
-_SPOTIFY_IMG_TIMEOUT = aiohttp.ClientTimeout(total=8)
-
-
-async def _get_spotify_token(session, client_id, client_secret):
-    global _spotify_token, _spotify_token_expires
-    if _spotify_token and time.monotonic() < _spotify_token_expires - 60:
-        return _spotify_token
-
-    try:
-        async with session.post(
-            "https://accounts.spotify.com/api/token",
-            auth=aiohttp.BasicAuth(client_id, client_secret),
-            data={"grant_type": "client_credentials"},
-            timeout=_SPOTIFY_API_TIMEOUT,
-        ) as resp:
-            if resp.status != 200:
-                log.warning("Spotify token request failed with status %s", resp.status)
-                return None
-            js = await resp.json()
-            _spotify_token = js["access_token"]
-            _spotify_token_expires = time.monotonic() + js["expires_in"]
-            log.debug("Refreshed Spotify access token")
-            return _spotify_token
-    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
-        log.warning("Failed to get Spotify token: %s", e)
-    except Exception as e:
-        log.exception("Unexpected error getting Spotify token: %s", e)
-    return None
-
 
-async def _fetch_spotify_art(session, artist, album, client_id, client_secret):
-    if not client_id or not client_secret:
-        return None
 
-    token = await _get_spotify_token(session, client_id, client_secret)
-    if not token:
-        return None
-
-    try:
-        params = {"q": f"album:{album} artist:{artist}", "type": "album", "limit": 1}
-        headers = {"Authorization": f"Bearer {token}"}
-        async with session.get(
-            "https://api.spotify.com/v1/search",
-            headers=headers,
-            params=params,
-            timeout=_SPOTIFY_API_TIMEOUT,
-        ) as resp:
-            if resp.status != 200:
-                log.debug("Spotify search returned status %s", resp.status)
-                return None
-            js = await resp.json()
-
-        items = js.get("albums", {}).get("items", [])
-        if not items:
-            log.debug("No Spotify results for %s / %s", artist, album)
-            return None
-
-        images = items[0].get("images", [])
-        if not images:
-            return None
-
-        image_url = images[0]["url"]  # Spotify sorts images largest-first
-        async with session.get(image_url, timeout=_SPOTIFY_IMG_TIMEOUT) as resp:
-            if resp.status == 200:
-                content = await resp.read()
-                log.info("Fetched album art from Spotify for %s / %s", artist, album)
-                return content
-            log.debug("Spotify image fetch returned status %s", resp.status)
-    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
-        log.warning("Spotify art fetch failed for %s / %s: %s", artist, album, e)
-    except Exception as e:
-        log.exception("Unexpected error fetching Spotify art for %s / %s: %s", artist, album, e)
-
-    return None
-
-
-async def fetch_album_bytes(
-    session, artist, album, lastfm_url, spotify_client_id=None, spotify_client_secret=None
-):
-    if lastfm_url and _LASTFM_PLACEHOLDER not in lastfm_url:
-        for attempt in range(2):
-            try:
-                async with session.get(lastfm_url, timeout=_LASTFM_TIMEOUT) as resp:
-                    if resp.status == 200:
-                        content = await resp.read()
-                        log.info("Fetched album art from Last.fm")
-                        return content
-                    log.debug("Last.fm returned status %s", resp.status)
-                    break
-            except asyncio.TimeoutError:
-                if attempt == 0:
-                    log.warning("Timeout fetching from Last.fm URL, retrying...")
-                else:
-                    log.warning("Last.fm URL timed out after retry")
-            except aiohttp.ClientError as e:
-                log.warning("Last.fm fetch error: %s", e)
-                break
-
-    spotify_bytes = await _fetch_spotify_art(
-        session, artist, album, spotify_client_id, spotify_client_secret
-    )
+async def _fetch_lastfm_art(session, lastfm_url):
+    """Returns (content, definitive). definitive is False when the fetch
+    failed in a way that might succeed if retried later."""
+    if not lastfm_url or _LASTFM_PLACEHOLDER in lastfm_url:
+        return None, True
+
+    for attempt in range(2):
+        try:
+            async with session.get(lastfm_url, timeout=_LASTFM_TIMEOUT) as resp:
+                if resp.status == 200:
+                    content = await resp.read()
+                    # Checked before it is cached, or a bad download would be
+                    # served for as long as the artwork TTL
+                    if not await asyncio.to_thread(validate_image_bytes, content):
+                        return None, False
+                    log.info("Fetched album art from Last.fm")
+                    return content, True
+                log.debug("Last.fm returned status %s", resp.status)
+                return None, resp.status < 500
+        except asyncio.TimeoutError:
+            if attempt == 0:
+                log.warning("Timeout fetching from Last.fm URL, retrying...")
+            else:
+                log.warning("Last.fm URL timed out after retry")
+        except aiohttp.ClientError as e:
+            log.warning("Last.fm fetch error: %s", e)
+            break
+
+    return None, False
+
+
+async def fetch_album_bytes(session, artist, album, lastfm_url, spotify=None, cache=None):
+    """Returns (content, source), source being where the artwork came from:
+    "cache", "lastfm" or "spotify", or "none" when nothing was found."""
+    key = album_key(artist, album)
+    if cache is not None:
+        cached = await cache.get(key)
+        if cached is None and lastfm_url:
+            cached = await cache.get(url_key(lastfm_url))
+        if cached == NO_ART:
+            log.debug("Cached miss for %s / %s", artist, album)
+            return None, "cache"
+        if cached:
+            return cached, "cache"
+
+    content, lastfm_definitive = await _fetch_lastfm_art(session, lastfm_url)
+    if content:
+        if cache is not None:
+            await cache.put(key, content)
+            await cache.put(url_key(lastfm_url), content)
+        return content, "lastfm"
+
+    spotify_bytes = NO_ART
+    if spotify is not None:
+        spotify_bytes = await spotify.fetch_album_art(artist, album, cache)
     if spotify_bytes:
-        return spotify_bytes
+        if cache is not None:
+            await cache.put(key, spotify_bytes)
+        return spotify_bytes, "spotify"
 
     log.warning("No album artwork found for %s / %s", artist, album)
-    return None
+    # Only remember the miss when every source gave a definite answer, a
+    # timeout or server error shouldn't hide the artwork for hours
+    if cache is not None and lastfm_definitive and spotify_bytes == NO_ART:
+        await cache.put_negative(key)
+    return None, "none"
 
 
 async def fetch_avatar_bytes(session, url):
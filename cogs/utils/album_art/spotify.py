@@ -0,0 +1,251 @@
+import asyncio
+import logging
+import time
+
+import aiohttp
+
+from ..lru import LRUCache
+from ..singleflight import SingleFlight
+from .cache import NO_ART, album_key, url_key
+from .decoder import validate_image_bytes
+
+log = logging.getLogger(__name__)
+
+_SPOTIFY_API_TIMEOUT = aiohttp.ClientTimeout(total=5)
+_SPOTIFY_IMG_TIMEOUT = aiohttp.ClientTimeout(total=8)
+
+# Renew the token this many seconds before Spotify says it expires
+_REFRESH_MARGIN = 300
+
+
+class SpotifyClient:
+    """Spotify Web API client used as the album artwork fallback.
+
+    The client credentials token is refreshed single-flight, and ahead of
+    expiry by a background task so requests rarely wait for it. Album search
+    results are cached, and a 429 pauses all Spotify calls for the
+    Retry-After period instead of hammering the API.
+    """
+
+    def __init__(
+        self,
+        session,
+        client_id,
+        client_secret,
+        search_cache_size=10_000,
+        search_ttl=24 * 3600,
+    ):
+        self._session = session
+        self._client_id = client_id
+        self._client_secret = client_secret
+        self._token = None
+        self._token_expires = 0.0
+        self._token_lock = asyncio.Lock()
+        self._refresh_task = None
+        self._blocked_until = 0.0
+        self._searches = LRUCache(max_entries=search_cache_size, ttl=search_ttl)
+        self._flight = SingleFlight()
+        self.token_refreshes = 0
+        self.rate_limited = 0
+
+    @property
+    def enabled(self):
+        return bool(self._client_id and self._client_secret)
+
+    def start(self):
+        if self.enabled and self._refresh_task is None:
+            self._refresh_task = asyncio.get_running_loop().create_task(
+                self._refresh_loop()
+            )
+
+    def close(self):
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            self._refresh_task = None
+
+    def _token_valid(self):
+        return self._token is not None and time.monotonic() < self._token_expires - 60
+
+    def _blocked(self):
+        return time.monotonic() < self._blocked_until
+
+    def _back_off(self, resp):
+        try:
+            retry_after = float(resp.headers.get("Retry-After", 1))
+        except ValueError:
+            retry_after = 1.0
+        self._blocked_until = max(self._blocked_until, time.monotonic() + retry_after)
+        self.rate_limited += 1
+        log.warning("Spotify rate limited us, backing off for %ss", retry_after)
+
+    async def _get_token(self):
+        if self._token_valid():
+            return self._token
+        async with self._token_lock:
+            # Someone else may have refreshed it while we waited for the lock
+            if not self._token_valid():
+                await self._refresh_token()
+        return self._token if self._token_valid() else None
+
+    async def _refresh_token(self):
+        """Asks Spotify for a new token. Returns whether that worked."""
+        if self._blocked():
+            return False
+        try:
+            async with self._session.post(
+                "https://accounts.spotify.com/api/token",
+                auth=aiohttp.BasicAuth(self._client_id, self._client_secret),
+                data={"grant_type": "client_credentials"},
+                timeout=_SPOTIFY_API_TIMEOUT,
+            ) as resp:
+                if resp.status == 429:
+                    self._back_off(resp)
+                    return False
+                if resp.status != 200:
+                    log.warning(
+                        "Spotify token request failed with status %s", resp.status
+                    )
+                    return False
+                js = await resp.json()
+                self._token = js["access_token"]
+                self._token_expires = time.monotonic() + js["expires_in"]
+                self.token_refreshes += 1
+                log.debug("Refreshed Spotify access token")
+                return True
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            log.warning("Failed to get Spotify token: %s", e)
+        except Exception as e:
+            log.exception("Unexpected error getting Spotify token: %s", e)
+        return False
+
+    async def _refresh_loop(self):
+        while True:
+            if self._token_valid():
+                delay = self._token_expires - _REFRESH_MARGIN - time.monotonic()
+            else:
+                delay = 0
+            delay = max(delay, self._blocked_until - time.monotonic())
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            async with self._token_lock:
+                refreshed = await self._refresh_token()
+
+            if not refreshed:
+                # Also while the old token is still valid: retrying inside the
+                # renewal margin right away would spin without yielding
+                await asyncio.sleep(max(30, self._blocked_until - time.monotonic()))
+
+    async def search_album_image(self, artist, album):
+        """Returns the largest image URL for the album, NO_ART if Spotify has
+        none, or None if Spotify couldn't be asked right now."""
+        if not self.enabled:
+            return NO_ART
+
+        key = album_key(artist, album)
+        url = self._searches.get(key)
+        if url is not None:
+            return url or NO_ART
+
+        if self._blocked():
+            return None
+        token = await self._get_token()
+        if not token:
+            return None
+
+        try:
+            params = {
+                "q": f"album:{album} artist:{artist}",
+                "type": "album",
+                "limit": 1,
+            }
+            headers = {"Authorization": f"Bearer {token}"}
+            async with self._session.get(
+                "https://api.spotify.com/v1/search",
+                headers=headers,
+                params=params,
+                timeout=_SPOTIFY_API_TIMEOUT,
+            ) as resp:
+                if resp.status == 429:
+                    self._back_off(resp)
+                    return None
+                if resp.status != 200:
+                    log.debug("Spotify search returned status %s", resp.status)
+                    return None
+                js = await resp.json()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            log.warning("Spotify search failed for %s / %s: %s", artist, album, e)
+            return None
+
+        items = js.get("albums", {}).get("items", [])
+        images = items[0].get("images", []) if items else []
+        if not images:
+            log.debug("No Spotify results for %s / %s", artist, album)
+            self._searches.put(key, "")
+            return NO_ART
+
+        url = images[0]["url"]  # Spotify sorts images largest-first
+        self._searches.put(key, url)
+        return url
+
+    async def fetch_album_art(self, artist, album, cache=None):
+        """Returns the album artwork bytes, NO_ART if Spotify has none, or
+        None on a failure that may be temporary. Concurrent requests for the
+        same album share one search and download."""
+        return await self._flight.do(
+            album_key(artist, album), self._fetch_album_art, artist, album, cache
+        )
+
+    async def _fetch_album_art(self, artist, album, cache):
+        try:
+            image_url = await self.search_album_image(artist, album)
+            if not image_url:
+                return image_url
+
+            if cache is not None:
+                content = await cache.get(url_key(image_url))
+                if content:
+                    return content
+
+            async with self._session.get(
+                image_url, timeout=_SPOTIFY_IMG_TIMEOUT
+            ) as resp:
+                if resp.status == 200:
+                    content = await resp.read()
+                    if not await asyncio.to_thread(validate_image_bytes, content):
+                        return None
+                    log.info(
+                        "Fetched album art from Spotify for %s / %s", artist, album
+                    )
+                    if cache is not None:
+                        await cache.put(url_key(image_url), content)
+                    return content
+                log.debug("Spotify image fetch returned status %s", resp.status)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            log.warning("Spotify art fetch failed for %s / %s: %s", artist, album, e)
+        except Exception as e:
+            log.exception(
+                "Unexpected error fetching Spotify art for %s / %s: %s",
+                artist,
+                album,
+                e,
+            )
+
+        return None
+
+    def stats(self):
+        return {
+            "token_refreshes": self.token_refreshes,
+            "rate_limited": self.rate_limited,
+            "search_cache": self._searches.stats(),
+        }
+
+    def prometheus(self):
+        """Returns the client's metrics in Prometheus text format, for
+        Metrics.add_collector."""
+        return self._searches.prometheus("spotify_search") + [
+            "# TYPE cosmo_spotify_token_refreshes_total counter",
+            f"cosmo_spotify_token_refreshes_total {self.token_refreshes}",
+            "# TYPE cosmo_spotify_rate_limited_total counter",
+            f"cosmo_spotify_rate_limited_total {self.rate_limited}",
+        ]
@@ -0,0 +1,51 @@
+import asyncio
+import logging
+
+from .album_art.fetcher import fetch_avatar_bytes
+from .lru import LRUCache
+from .singleflight import SingleFlight
+
+log = logging.getLogger(__name__)
+
+
+class AvatarCache:
+    """Caches finished circular avatar tiles keyed by Discord's avatar hash.
+
+    The hash changes whenever a user changes their avatar, so entries never
+    need invalidating; old ones simply age out of the LRU.
+    """
+
+    def __init__(self, session, max_entries=10_000, max_bytes=64 * 1024 * 1024):
+        self._session = session
+        self._cache = LRUCache(max_entries=max_entries, max_bytes=max_bytes)
+        self._flight = SingleFlight()
+
+    async def get(self, asset):
+        """Returns the avatar tile for a discord.Asset, or None if the avatar
+        couldn't be downloaded."""
+        tile = self._cache.get(asset.key)
+        if tile is not None:
+            return tile
+        return await self._flight.do(asset.key, self._fetch, asset)
+
+    async def _fetch(self, asset):
+        from .fmi_builder import FmiBuilder
+
+        url = str(asset.replace(format="png", size=128))
+        avatar_bytes = await fetch_avatar_bytes(self._session, url)
+        if not avatar_bytes:
+            return None
+
+        tile = await asyncio.to_thread(
+            FmiBuilder.mask_and_resize_discord_avatar, avatar_bytes
+        )
+        self._cache.put(asset.key, tile)
+        return tile
+
+    def stats(self):
+        return self._cache.stats()
+
+    def prometheus(self):
+        """Returns the cache's metrics in Prometheus text format, for
+        Metrics.add_collector."""
+        return self._cache.prometheus("avatar")
@@ -0,0 +1,182 @@
+import logging
+import multiprocessing
+import signal
+import time
+from multiprocessing.connection import wait
+
+import aiohttp
+
+log = logging.getLogger(__name__)
+
+GATEWAY_URL = "https://discord.com/api/v10/gateway/bot"
+# Discord allows max_concurrency identifies per this many seconds
+IDENTIFY_INTERVAL = 5.0
+
+
+def parse_shard_ids(text):
+    """Parses "0-7,16-23" style ranges into a sorted list of shard ids."""
+    shard_ids = set()
+    for part in text.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        first, _, last = part.partition("-")
+        shard_ids.update(range(int(first), int(last or first) + 1))
+    return sorted(shard_ids)
+
+
+def split_shards(shard_ids, clusters):
+    """Splits shard_ids into at most ``clusters`` contiguous, even chunks."""
+    clusters = max(1, min(clusters, len(shard_ids)))
+    size, extra = divmod(len(shard_ids), clusters)
+    chunks = []
+    start = 0
+    for i in range(clusters):
+        end = start + size + (i < extra)
+        chunks.append(shard_ids[start:end])
+        start = end
+    return chunks
+
+
+async def fetch_gateway_info(token):
+    """Returns Discord's recommended shard count and how many shards may
+    identify at once."""
+    headers = {"Authorization": f"Bot {token}"}
+    async with aiohttp.ClientSession() as session:
+        async with session.get(GATEWAY_URL, headers=headers) as resp:
+            resp.raise_for_status()
+            data = await resp.json()
+    return data["shards"], data["session_start_limit"]["max_concurrency"]
+
+
+class _Cluster:
+    __slots__ = ("cluster_id", "shard_ids", "process", "start_at", "started", "crashes")
+
+    def __init__(self, cluster_id, shard_ids, start_at):
+        self.cluster_id = cluster_id
+        self.shard_ids = shard_ids
+        self.process = None
+        self.start_at = start_at
+        self.started = 0.0
+        self.crashes = 0
+
+
+class ClusterSupervisor:
+    """Runs each chunk of shards in its own process and restarts the ones
+    that die.
+
+    ``target(cluster_id, shard_ids)`` is called in the new process. Clusters
+    start one after another, each once the previous one's shards had time to
+    identify. A cluster that exits with status 0 was shut down on purpose and
+    is left alone, others are restarted after a delay that doubles with each
+    crash in a row, up to ``max_delay``. A cluster that stays up for
+    ``stable_after`` seconds starts again from the shortest delay.
+    """
+
+    def __init__(
+        self,
+        target,
+        shard_chunks,
+        identify_delay=IDENTIFY_INTERVAL,
+        max_delay=60.0,
+        stable_after=300.0,
+        stop_timeout=30.0,
+    ):
+        self._target = target
+        self._context = multiprocessing.get_context("spawn")
+        self.max_delay = max_delay
+        self.stable_after = stable_after
+        self.stop_timeout = stop_timeout
+        self.restarts = 0
+        self._stopping = False
+
+        now = time.monotonic()
+        self._clusters = []
+        start_at = now
+        for cluster_id, shard_ids in enumerate(shard_chunks):
+            self._clusters.append(_Cluster(cluster_id, shard_ids, start_at))
+            start_at += len(shard_ids) * identify_delay
+
+    def run(self):
+        """Supervises the clusters until SIGINT or SIGTERM, or until all of
+        them exited on purpose."""
+        signal.signal(signal.SIGINT, self._request_stop)
+        signal.signal(signal.SIGTERM, self._request_stop)
+        try:
+            while not self._stopping:
+                pending = [c for c in self._clusters if c.process is None]
+                running = [c for c in self._clusters if c.process is not None]
+                if not pending and not running:
+                    log.info("All clusters exited, stopping")
+                    break
+
+                now = time.monotonic()
+                for cluster in pending:
+                    if cluster.start_at <= now:
+                        self._start(cluster)
+
+                timeout = min((c.start_at for c in pending), default=now + 1) - now
+                wait(
+                    [c.process.sentinel for c in self._clusters if c.process],
+                    timeout=min(max(timeout, 0.1), 1.0),
+                )
+                for cluster in list(self._clusters):
+                    if cluster.process is not None and not cluster.process.is_alive():
+                        self._reap(cluster)
+        finally:
+            self._stop_all()
+
+    def _request_stop(self, signum, frame):
+        log.info("Received signal %s, stopping clusters", signum)
+        self._stopping = True
+
+    def _start(self, cluster):
+        process = self._context.Process(
+            target=self._target,
+            args=(cluster.cluster_id, cluster.shard_ids),
+            name=f"cosmo-cluster-{cluster.cluster_id}",
+        )
+        process.start()
+        cluster.process = process
+        cluster.started = time.monotonic()
+        log.info(
+            "Started cluster %s (pid %s) with shards %s",
+            cluster.cluster_id,
+            process.pid,
+            cluster.shard_ids,
+        )
+
+    def _reap(self, cluster):
+        process = cluster.process
+        process.join()
+        cluster.process = None
+        if process.exitcode == 0:
+            log.info("Cluster %s exited cleanly", cluster.cluster_id)
+            self._clusters.remove(cluster)
+            return
+
+        now = time.monotonic()
+        if now - cluster.started >= self.stable_after:
+            cluster.crashes = 0
+        delay = min(2.0**cluster.crashes, self.max_delay)
+        cluster.crashes += 1
+        cluster.start_at = now + delay
+        self.restarts += 1
+        log.warning(
+            "Cluster %s exited with status %s, restarting in %.0fs",
+            cluster.cluster_id,
+            process.exitcode,
+            delay,
+        )
+
+    def _stop_all(self):
+        running = [c.process for c in self._clusters if c.process is not None]
+        for process in running:
+            process.terminate()
+        deadline = time.monotonic() + self.stop_timeout
+        for process in running:
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                log.warning("Cluster %s did not stop in time, killing it", process.name)
+                process.kill()
+                process.join()
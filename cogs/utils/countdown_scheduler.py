@@ -0,0 +1,185 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import math
+import time
+from collections import deque
+
+import discord
+
+log = logging.getLogger(__name__)
+
+# Discord lets a channel's messages be edited about this many times per window
+EDIT_LIMIT = 5
+EDIT_WINDOW = 5.0
+LATE_MS = 50
+
+
+class _Countdown:
+    __slots__ = (
+        "message",
+        "channel_id",
+        "start",
+        "start_ms",
+        "seconds",
+        "tick",
+        "edit",
+    )
+
+    def __init__(self, message, start, seconds):
+        self.message = message
+        self.channel_id = message.channel.id
+        self.start = start
+        # The edit budget works in whole milliseconds so that ticks exactly
+        # one window apart compare as such
+        self.start_ms = round(start * 1000)
+        self.seconds = seconds
+        # Seconds elapsed at the next tick, which shows seconds - tick
+        self.tick = 1
+        self.edit = None
+
+    def tick_ms(self, tick):
+        return self.start_ms + tick * 1000
+
+
+class CountdownScheduler:
+    """Runs every countdown from one task.
+
+    Tick ``k`` of a countdown is due ``k`` seconds after its first message
+    was sent, measured on the monotonic clock, so slow edits never push the
+    following ones back. A tick that comes due while the previous edit is
+    still in flight, or that would use up the channel's edit budget, is
+    skipped rather than queued. Every countdown keeps one edit of its
+    channel's budget for "Go!", which goes out at its deadline and cancels
+    any number still waiting to be sent, so it can't be overwritten.
+    """
+
+    def __init__(self, edit_limit=EDIT_LIMIT, edit_window=EDIT_WINDOW):
+        self.edit_limit = edit_limit
+        self.edit_window = edit_window
+        self._window_ms = round(edit_window * 1000)
+        self._heap = []
+        self._sequence = itertools.count()
+        self._channels = {}
+        self._edits = {}
+        self._wake = asyncio.Event()
+        self._task = None
+        self.skipped = 0
+
+    def add(self, message, seconds, start):
+        """Counts ``message`` down from ``seconds``, which it was sent
+        showing at monotonic time ``start``."""
+        countdown = _Countdown(message, start, seconds)
+        # Channels whose last edit can't affect anything any more
+        now_ms = time.monotonic() * 1000
+        for channel_id, edits in list(self._edits.items()):
+            if edits[-1] <= now_ms - self._window_ms:
+                del self._edits[channel_id]
+        self._channels.setdefault(countdown.channel_id, set()).add(countdown)
+        self._schedule(countdown)
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        self._wake.set()
+
+    def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def _schedule(self, countdown):
+        due = countdown.start + countdown.tick
+        heapq.heappush(self._heap, (due, next(self._sequence), countdown))
+
+    async def _run(self):
+        while self._heap:
+            due, _, countdown = self._heap[0]
+            delay = due - time.monotonic()
+            if delay > 0:
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            heapq.heappop(self._heap)
+            self._tick(countdown, time.monotonic())
+
+    def _tick(self, countdown, now):
+        if countdown not in self._channels.get(countdown.channel_id, ()):
+            # Stopped after its message went away
+            return
+
+        # Anything older than the latest tick that is due is stale
+        due = min(countdown.seconds, math.floor(now - countdown.start))
+        if due > countdown.tick:
+            self.skipped += due - countdown.tick
+            countdown.tick = due
+        sent_ms = countdown.tick_ms(countdown.tick)
+        # A late edit uses up the budget from when it is actually sent, but
+        # the loop waking a few milliseconds after a deadline isn't late
+        if now * 1000 - sent_ms > LATE_MS:
+            sent_ms = round(now * 1000)
+
+        if countdown.tick >= countdown.seconds:
+            if countdown.edit is not None:
+                countdown.edit.cancel()
+            self._record(countdown.channel_id, sent_ms)
+            self._finish(countdown)
+            countdown.edit = asyncio.ensure_future(self._edit(countdown, "Go!"))
+            return
+
+        if countdown.edit is not None and not countdown.edit.done():
+            self.skipped += 1
+        elif not self._can_edit(countdown.channel_id, sent_ms):
+            self.skipped += 1
+        else:
+            self._record(countdown.channel_id, sent_ms)
+            content = str(countdown.seconds - countdown.tick)
+            countdown.edit = asyncio.ensure_future(self._edit(countdown, content))
+        countdown.tick += 1
+        self._schedule(countdown)
+
+    def _can_edit(self, channel_id, at):
+        """Whether an edit at ``at`` (in ms) leaves room for every pending
+        "Go!" in the channel, and for itself, within the edit budget. Edits
+        are counted at their deadlines, which is when they are sent."""
+        edits = self._edits.get(channel_id, ())
+        window = self._window_ms
+        if sum(1 for t in edits if t > at - window) + 1 > self.edit_limit:
+            return False
+
+        gos = [c.tick_ms(c.seconds) for c in self._channels.get(channel_id, ())]
+        for go in gos:
+            if go - window >= at:
+                continue
+            used = sum(1 for t in edits if t > go - window) + 1
+            used += sum(1 for other in gos if go - window < other <= go)
+            if used > self.edit_limit:
+                return False
+        return True
+
+    def _record(self, channel_id, at):
+        edits = self._edits.setdefault(channel_id, deque())
+        edits.append(at)
+        # Nothing due from now on can share a window with these
+        while edits and edits[0] <= at - self._window_ms:
+            edits.popleft()
+
+    def _finish(self, countdown):
+        countdowns = self._channels.get(countdown.channel_id)
+        if countdowns is None:
+            return
+        countdowns.discard(countdown)
+        if not countdowns:
+            del self._channels[countdown.channel_id]
+
+    async def _edit(self, countdown, content):
+        try:
+            await countdown.message.edit(content=content)
+        except (discord.NotFound, discord.Forbidden):
+            # Deleted, or we lost access to the channel
+            self._finish(countdown)
+        except discord.HTTPException as e:
+            log.warning("Failed to update countdown: %s", e)
+            self._finish(countdown)
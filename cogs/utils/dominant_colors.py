@@ -1,43 +1,59 @@
-import colour
-import cv2
 import numpy as np
-from skimage.color import lab2rgb
-from sklearn.cluster import KMeans
+
+# colour, cv2 and sklearn take seconds to import between them, so they are
+# imported where they are used. Only the render workers ever need them.
+
+# D65 white point and the sRGB matrices, the same constants skimage uses
+_D65 = np.array([0.95047, 1.0, 1.08883])
+_XYZ_FROM_RGB = np.array(
+    [
+        [0.412453, 0.357580, 0.180423],
+        [0.212671, 0.715160, 0.072169],
+        [0.019334, 0.119193, 0.950227],
+    ]
+)
+_RGB_FROM_XYZ = np.linalg.inv(_XYZ_FROM_RGB)
+
+
+def preload():
+    """Imports every backend up front, for processes that will render."""
+    import colour  # noqa: F401
+    import cv2  # noqa: F401
+    import sklearn.cluster  # noqa: F401
 
 
 def lab_to_rgb(color):
-    lab = [[[color[0], color[1], color[2]]]]
-    rgb = lab2rgb(lab)[0][0]
-    return [int(np.clip(c * 255, 0, 255)) for c in rgb]
+    """Converts one CIELAB colour to 8-bit sRGB, matching skimage's lab2rgb."""
+    L, a, b = color[0], color[1], color[2]
+    fy = (L + 16.0) / 116.0
+    f = np.array([a / 500.0 + fy, fy, max(fy - b / 200.0, 0.0)])
+    xyz = np.where(f > 0.2068966, f**3, (f - 16.0 / 116.0) / 7.787) * _D65
 
+    rgb = _RGB_FROM_XYZ @ xyz
+    rgb = np.where(
+        rgb > 0.0031308,
+        1.055 * np.power(np.maximum(rgb, 0.0031308), 1 / 2.4) - 0.055,
+        rgb * 12.92,
+    )
+    return [int(c) for c in np.clip(rgb * 255, 0, 255)]
 
-def dominant_colors(image, clusters=5):
-    img = np.frombuffer(image, dtype=np.uint8)
-    img = cv2.imdecode(img, cv2.IMREAD_UNCHANGED)
 
-    if len(img.shape) == 2:
-        img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
-    elif len(img.shape) == 3 and img.shape[2] == 1:
-        img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+def _to_lab_pixels(image):
+    import cv2
 
-    img = cv2.cvtColor(img.astype(np.float32) / 255, cv2.COLOR_BGR2LAB)
-    img = img.reshape((img.shape[0] * img.shape[1], 3))
+    # Accepts RGB or RGBA, alpha is ignored just like the colour engine always has
+    img = cv2.cvtColor(image[..., :3].astype(np.float32) / 255, cv2.COLOR_RGB2LAB)
+    return img.reshape((-1, 3))
 
-    cluster = KMeans(n_clusters=clusters, tol=0.001, random_state=42)
-    cluster.fit(img)
 
-    colors = cluster.cluster_centers_
-    labels = cluster.labels_
+def _sorted_by_share(colors, labels):
+    percent = np.bincount(labels, minlength=len(colors)) / len(labels)
+    order = (-percent).argsort()
+    return colors[order], percent[order]
 
-    labels = list(labels)
-    percent = []
-    for i in range(len(colors)):
-        j = labels.count(i)
-        j = j / len(labels)
-        percent.append(j)
 
-    percent = np.array(percent)
-    colors = colors[(-percent).argsort()]
+def _primary_and_secondary(colors):
+    import colour
 
     counter = 1
     primary = colors[0]
@@ -48,7 +64,7 @@ def dominant_colors(image, clusters=5):
     highest_delta_e = delta_e
 
     if delta_e < 20:
-        while delta_e < 20 and counter < 4:
+        while delta_e < 20 and counter < len(colors) - 1:
             counter += 1
             secondary = colors[counter]
             delta_e = colour.difference.delta_E_CIE2000(primary, secondary)
@@ -60,6 +76,50 @@ def dominant_colors(image, clusters=5):
     return lab_to_rgb(primary), lab_to_rgb(secondary)
 
 
+def dominant_colors(image, clusters=5):
+    from sklearn.cluster import KMeans
+
+    img = _to_lab_pixels(image)
+
+    cluster = KMeans(n_clusters=clusters, tol=0.001, random_state=42)
+    cluster.fit(img)
+
+    colors, _ = _sorted_by_share(cluster.cluster_centers_, cluster.labels_)
+    return _primary_and_secondary(colors)
+
+
+def dominant_colors_fast(image, clusters=5, sample_pixels=16384):
+    """Approximates dominant_colors on a thumbnail of at most sample_pixels
+    pixels, so the cost no longer grows with the size of the artwork."""
+    import cv2
+    from sklearn.cluster import MiniBatchKMeans
+
+    height, width = image.shape[:2]
+    scale = (sample_pixels / (height * width)) ** 0.5
+    if scale < 1:
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        # INTER_AREA averages each block of pixels, which keeps the colour
+        # proportions of the original intact
+        image = cv2.resize(
+            np.ascontiguousarray(image), size, interpolation=cv2.INTER_AREA
+        )
+
+    img = _to_lab_pixels(image)
+
+    cluster = MiniBatchKMeans(
+        n_clusters=clusters,
+        batch_size=1024,
+        max_iter=50,
+        n_init=3,
+        tol=0.001,
+        random_state=42,
+    )
+    cluster.fit(img)
+
+    colors, _ = _sorted_by_share(cluster.cluster_centers_, cluster.labels_)
+    return _primary_and_secondary(colors)
+
+
 # --- v2: vibrant color preference ---
 
 def _chroma_boost(c, scale=40):
@@ -70,31 +130,67 @@ def _lightness_weight(L, center=55, spread=25):
     return np.exp(-(((L - center) / spread) ** 2))
 
 
-def _lab_to_lch(color):
-    L, a, b = color
+def _lab_to_lch(colors):
+    L, a, b = colors.T
     C = np.sqrt(a**2 + b**2)
     h = (np.degrees(np.arctan2(b, a)) + 360) % 360
     return L, C, h
 
 
 def _hue_distance(h1, h2):
-    d = abs(h1 - h2)
-    return min(d, 360 - d)
+    d = np.abs(h1 - h2)
+    return np.minimum(d, 360 - d)
 
 
 def _hue_opposition_boost(d):
     return np.exp(-(((d - 150) / 40) ** 2))
 
 
-def _hue_density(target_h, hues, chromas, bandwidth=20):
-    dists = np.array([_hue_distance(target_h, h) for h in hues])
+def _hue_density(hues, chromas, bandwidth=20):
+    # Row i is the chroma-weighted density of every cluster around hue i
+    dists = _hue_distance(hues[:, None], hues[None, :])
     weights = np.exp(-((dists / bandwidth) ** 2))
-    return np.sum(weights * chromas)
+    return np.sum(weights * chromas, axis=1)
+
 
+def _hue_isolation_bonus(hues, chromas):
+    return 1.0 / (1.0 + _hue_density(hues, chromas))
 
-def _hue_isolation_bonus(h, hues, chromas):
-    density = _hue_density(h, hues, chromas)
-    return 1.0 / (1.0 + density)
+
+def _pick_secondary_v2(colors, percent, min_delta_e, min_percentage, min_chroma):
+    """Scores every cluster against the primary (colors[0]) in one pass and
+    returns the index of the secondary colour."""
+    import colour
+
+    if len(colors) < 2:
+        return 0
+
+    L, C, h = _lab_to_lch(colors)
+    delta_e = colour.difference.delta_E_CIE2000(colors[0], colors)
+
+    # The primary itself is never a candidate
+    distinct = (delta_e >= min_delta_e) & (C >= min_chroma)
+    distinct[0] = False
+
+    candidates = distinct & (percent >= min_percentage)
+    if candidates.any():
+        score = (
+            0.30 * (delta_e / 50.0)
+            + 0.28 * _chroma_boost(C)
+            + 0.12 * np.sqrt(percent)
+            + 0.05 * _lightness_weight(L)
+            + 0.15 * _hue_opposition_boost(_hue_distance(h[0], h))
+            + 0.10 * _hue_isolation_bonus(h, C)
+        )
+        return int(np.argmax(np.where(candidates, score, -np.inf)))
+
+    if distinct.any():
+        # Relax min_percentage but keep chroma — prevents white/gray winning on dark albums
+        score = 0.5 * _chroma_boost(C) + 0.5 * (delta_e / 50.0)
+        return int(np.argmax(np.where(distinct, score, -np.inf)))
+
+    # Last resort: highest delta-E regardless of chroma (truly achromatic image)
+    return int(np.argmax(delta_e[1:])) + 1
 
 
 def dominant_colors_v2(
@@ -104,85 +200,24 @@ def dominant_colors_v2(
     min_percentage=0.02,
     min_chroma=12,
 ):
-    img = np.frombuffer(image, dtype=np.uint8)
-    img = cv2.imdecode(img, cv2.IMREAD_UNCHANGED)
+    from sklearn.cluster import KMeans
 
-    if len(img.shape) == 2 or (len(img.shape) == 3 and img.shape[2] == 1):
-        img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
-
-    img = cv2.cvtColor(img.astype(np.float32) / 255, cv2.COLOR_BGR2LAB)
-    img = img.reshape((-1, 3))
+    img = _to_lab_pixels(image)
 
     cluster = KMeans(n_clusters=clusters, tol=0.001, random_state=42)
     cluster.fit(img)
 
-    colors = cluster.cluster_centers_
-    labels = cluster.labels_
+    colors, percent = _sorted_by_share(cluster.cluster_centers_, cluster.labels_)
 
-    percent = np.array([(labels == i).sum() / len(labels) for i in range(len(colors))])
-    order = (-percent).argsort()
-    colors = colors[order]
-    percent = percent[order]
+    secondary_idx = _pick_secondary_v2(
+        colors, percent, min_delta_e, min_percentage, min_chroma
+    )
 
-    primary = colors[0]
+    return lab_to_rgb(colors[0]), lab_to_rgb(colors[secondary_idx])
 
-    lch = [_lab_to_lch(c) for c in colors]
-    hues = np.array([h for _, _, h in lch])
-    chromas = np.array([C for _, C, _ in lch])
 
-    candidates = []
-
-    for i in range(1, len(colors)):
-        if percent[i] < min_percentage:
-            continue
-
-        delta_e = colour.difference.delta_E_CIE2000(primary, colors[i])
-        if delta_e < min_delta_e:
-            continue
-
-        L, C, h = lch[i]
-        if C < min_chroma:
-            continue
-
-        delta_norm = delta_e / 50.0
-        chroma_norm = _chroma_boost(C)
-        freq_norm = np.sqrt(percent[i])
-        lightness_norm = _lightness_weight(L)
-        hue_opp = _hue_opposition_boost(_hue_distance(lch[0][2], h))
-        hue_iso = _hue_isolation_bonus(h, hues, chromas)
-
-        score = (
-            0.30 * delta_norm
-            + 0.28 * chroma_norm
-            + 0.12 * freq_norm
-            + 0.05 * lightness_norm
-            + 0.15 * hue_opp
-            + 0.10 * hue_iso
-        )
-
-        candidates.append((score, i))
-
-    if not candidates:
-        # Relax min_percentage but keep chroma — prevents white/gray winning on dark albums
-        for i in range(1, len(colors)):
-            delta_e = colour.difference.delta_E_CIE2000(primary, colors[i])
-            if delta_e < min_delta_e:
-                continue
-            L, C, h = lch[i]
-            if C < min_chroma:
-                continue
-            score = 0.5 * _chroma_boost(C) + 0.5 * (delta_e / 50.0)
-            candidates.append((score, i))
-
-    if not candidates:
-        # Last resort: highest delta-E regardless of chroma (truly achromatic image)
-        fallback = [
-            (colour.difference.delta_E_CIE2000(primary, colors[i]), i)
-            for i in range(1, len(colors))
-        ]
-        secondary_idx = max(fallback, key=lambda x: x[0])[1] if fallback else 0
-        secondary = colors[secondary_idx]
-    else:
-        secondary = colors[max(candidates, key=lambda x: x[0])[1]]
-
-    return lab_to_rgb(primary), lab_to_rgb(secondary)
+COLOR_MODES = {
+    "exact": dominant_colors,
+    "fast": dominant_colors_fast,
+    "v2": dominant_colors_v2,
+}
@@ -1,20 +1,52 @@
 from io import BytesIO
+from typing import NamedTuple
+
 import imagetext_py as ipy
 from PIL import Image, ImageDraw
 
 from .dominant_colors import dominant_colors
 
 
+# Bump whenever a change here alters the rendered image, so cached renders
+# from the old layout are not served
+RENDERER_VERSION = 1
+
+AVATAR_SIZE = (64, 64)
+
+
+class OutputProfile(NamedTuple):
+    format: str
+    extension: str
+    options: dict
+    # Reduce to a 256 colour palette before encoding
+    quantize: bool = False
+
+
+# How the finished card is encoded. png is what the bot has always sent, the
+# others trade encoder CPU against upload size without changing the layout.
+OUTPUT_PROFILES = {
+    "png": OutputProfile("PNG", "png", {}),
+    "png_fast": OutputProfile("PNG", "png", {"compress_level": 1}),
+    "png_palette": OutputProfile("PNG", "png", {"optimize": True}, quantize=True),
+    # Lowest lossless effort: still smaller than png and several times faster
+    "webp": OutputProfile(
+        "WEBP", "webp", {"lossless": True, "quality": 0, "method": 0}
+    ),
+    "webp_lossy": OutputProfile("WEBP", "webp", {"quality": 90, "method": 4}),
+}
+
 BLACK = ipy.Paint.Color((0, 0, 0, 255))
 WHITE = ipy.Paint.Color((255, 255, 255, 255))
 
 
 class FmiBuilder:
-    def __init__(self, album_bytes, avatar_bytes, text, color_fn=None):
-        fn = color_fn if color_fn is not None else dominant_colors
-        self._primary, self._secondary = fn(album_bytes.getvalue())
-        self._avatar_image = self.mask_and_resize_discord_avatar(avatar_bytes)
-        self._album_image = Image.open(album_bytes).resize(
+    def __init__(self, album, avatar_tile, text, color_fn=None, palette=None):
+        if palette is None:
+            fn = color_fn if color_fn is not None else dominant_colors
+            palette = fn(album.rgba)
+        self._primary, self._secondary = palette
+        self._avatar_image = Image.frombytes("RGBA", AVATAR_SIZE, avatar_tile)
+        self._album_image = album.image.resize(
             (124, 124), resample=Image.Resampling.LANCZOS
         )
         self._text = text
@@ -22,7 +54,27 @@ class FmiBuilder:
         self._background = Image.new("RGBA", (548, 147), tuple(self._primary))
         self._background_draw = ImageDraw.Draw(self._background)
 
+    @property
+    def palette(self):
+        return self._primary, self._secondary
+
     def create_fmi(self):
+        return self.encode(self.compose())
+
+    @staticmethod
+    def encode(image, profile="png"):
+        profile = OUTPUT_PROFILES[profile]
+        if profile.quantize:
+            # FASTOCTREE is the only built-in quantizer that keeps alpha
+            image = image.quantize(256, method=Image.Quantize.FASTOCTREE)
+
+        arr = BytesIO()
+        image.save(arr, format=profile.format, **profile.options)
+        arr.seek(0)
+        return arr
+
+    def compose(self):
+        """Draws the fmi and returns it as an unencoded PIL image."""
         # Paste the album image
         self._background.paste(self._album_image, (12, 12))
 
@@ -64,20 +116,30 @@ class FmiBuilder:
                 fill=self._text_color,
             )
 
-        arr = BytesIO()
-        self._background.save(arr, format="PNG")
-        arr.seek(0)
-        return arr
+        return self._background
+
+    @staticmethod
+    def stack(images):
+        """Stacks composed cards top to bottom into one image."""
+        width = max(image.width for image in images)
+        stacked = Image.new("RGBA", (width, sum(image.height for image in images)))
+        y = 0
+        for image in images:
+            stacked.paste(image, (0, y))
+            y += image.height
+        return stacked
 
-    def mask_and_resize_discord_avatar(self, avatar_bytes):
-        avatar = Image.open(avatar_bytes).convert("RGB")
+    @staticmethod
+    def mask_and_resize_discord_avatar(avatar_bytes):
+        """Turns a downloaded avatar into the circular tile FmiBuilder takes,
+        as raw RGBA bytes so it can be cached and sent to render workers."""
+        avatar = Image.open(BytesIO(avatar_bytes)).convert("RGB")
         mask = Image.new("L", avatar.size, 0)
         draw = ImageDraw.Draw(mask)
         draw.ellipse([0, 0, avatar.size[0], avatar.size[1]], fill=255)
-        result = avatar.copy()
-        result.putalpha(mask)
-        resized = result.resize((64, 64), resample=Image.Resampling.LANCZOS)
-        return resized
+        avatar.putalpha(mask)
+        resized = avatar.resize(AVATAR_SIZE, resample=Image.Resampling.LANCZOS)
+        return resized.tobytes()
 
     def get_text_color(self, primary_color):
         if sum(primary_color) > 250:
@@ -3,36 +3,64 @@ import imagetext_py as ipy
 import arabic_reshaper
 from bidi.algorithm import get_display
 
+from .lru import LRUCache
+
+_ARABIC = re.compile("[\u0600-\u06ff]")
+_RTL = re.compile("[\u0590-\u05fe\u0600-\u06ff]")
+
 
 class FmiText:
-    ipy.FontDB.LoadFromDir("./fonts")
-    regular_fonts = ipy.FontDB.Query(
+    REGULAR_FONT_NAMES = (
         "NotoSans-Regular NotoSansHK-Regular NotoSansJP-Regular NotoSansKR-Regular NotoSansSC-Regular "
         + "NotoSansTC-Regular NotoSansArabic-Regular Heebo-Regular NotoEmoji-Regular Symbola Unifont"
     )
-    bold_fonts = ipy.FontDB.Query(
+    BOLD_FONT_NAMES = (
         "NotoSans-SemiBold NotoSansJP-Medium NotoSansKR-Medium NotoSansSC-Medium "
         + "NotoSansTC-Medium NotoSansArabic-SemiBold Heebo-SemiBold NotoEmoji-Medium Symbola Unifont"
     )
 
+    ipy.FontDB.LoadFromDir("./fonts")
+    regular_fonts = ipy.FontDB.Query(REGULAR_FONT_NAMES)
+    bold_fonts = ipy.FontDB.Query(BOLD_FONT_NAMES)
+
+    # Finished layouts shared by every render in this process, so a popular
+    # song is shaped and measured once rather than once per request
+    layout_cache = LRUCache(max_entries=4096)
+
     def __init__(self, lastfmdata):
         self.font_size = 19
         self.title_text = self.process_text(lastfmdata.title, text_type="title")
         self.artist_text = self.process_text(lastfmdata.artist, text_type="artist")
         self.album_text = self.process_text(lastfmdata.album, text_type="album")
 
+    @classmethod
+    def layout_stats(cls):
+        return cls.layout_cache.stats()
+
     def contains_arabic(self, text):
-        return bool(re.search("[\u0600-\u06ff]", text))
+        return bool(_ARABIC.search(text))
 
     def is_rtl_language(self, text):
-        return bool(
-            re.search("[\u0600-\u06ff]", text) or re.search("[\u0590-\u05fe]", text)
-        )
+        return bool(_RTL.search(text))
 
     def reshape_arabic_text(self, text):
         return arabic_reshaper.reshape(text)
 
     def process_text(self, text, text_type):
+        fonts = (
+            self.BOLD_FONT_NAMES if text_type == "title" else self.REGULAR_FONT_NAMES
+        )
+        key = (text, text_type, self.font_size, fonts)
+        layout = self.layout_cache.get(key)
+        if layout is None:
+            layout = self.layout_text(text, text_type)
+            # Stored immutable, handed out as a fresh list like text_wrap returns
+            if isinstance(layout, list):
+                layout = tuple(layout)
+            self.layout_cache.put(key, layout)
+        return list(layout) if isinstance(layout, tuple) else layout
+
+    def layout_text(self, text, text_type):
         if self.is_rtl_language(text):
             if self.contains_arabic(text):
                 text = self.reshape_arabic_text(text)
@@ -0,0 +1,107 @@
+import time
+from collections import defaultdict
+
+import aiohttp
+
+
+class _HostStats:
+    __slots__ = ("requests", "created", "reused", "queued", "wait_total", "wait_max")
+
+    def __init__(self):
+        self.requests = 0
+        self.created = 0
+        self.reused = 0
+        self.queued = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+
+class SessionStats:
+    """Collects per-host connection pool statistics from aiohttp trace events:
+    new vs reused connections and time spent queued for a free connection."""
+
+    def __init__(self):
+        self._hosts = defaultdict(_HostStats)
+
+    def trace_config(self):
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_start.append(self._on_request_start)
+        trace_config.on_connection_queued_start.append(self._on_queued_start)
+        trace_config.on_connection_queued_end.append(self._on_queued_end)
+        trace_config.on_connection_create_end.append(self._on_create_end)
+        trace_config.on_connection_reuseconn.append(self._on_reuseconn)
+        return trace_config
+
+    async def _on_request_start(self, session, ctx, params):
+        ctx.host = params.url.host
+        self._hosts[ctx.host].requests += 1
+
+    async def _on_queued_start(self, session, ctx, params):
+        ctx.queued_at = time.perf_counter()
+
+    async def _on_queued_end(self, session, ctx, params):
+        wait = time.perf_counter() - ctx.queued_at
+        host = self._hosts[ctx.host]
+        host.queued += 1
+        host.wait_total += wait
+        host.wait_max = max(host.wait_max, wait)
+
+    async def _on_create_end(self, session, ctx, params):
+        self._hosts[ctx.host].created += 1
+
+    async def _on_reuseconn(self, session, ctx, params):
+        self._hosts[ctx.host].reused += 1
+
+    def snapshot(self, connector):
+        """Returns a dict of stats per host, including the connections the
+        connector currently holds open (active) and keeps alive (idle)."""
+        idle = defaultdict(int)
+        for key, conns in getattr(connector, "_conns", {}).items():
+            idle[key.host] += len(conns)
+        active = defaultdict(int)
+        for key, conns in getattr(connector, "_acquired_per_host", {}).items():
+            active[key.host] += len(conns)
+
+        result = {}
+        for name in sorted(set(self._hosts) | set(idle) | set(active)):
+            host = self._hosts[name]
+            connections = host.created + host.reused
+            result[name] = {
+                "requests": host.requests,
+                "active": active[name],
+                "idle": idle[name],
+                "open": active[name] + idle[name],
+                "created": host.created,
+                "reused": host.reused,
+                "reuse_ratio": host.reused / connections if connections else 0.0,
+                "queued": host.queued,
+                "avg_wait_ms": host.wait_total / host.queued * 1000
+                if host.queued
+                else 0.0,
+                "max_wait_ms": host.wait_max * 1000,
+            }
+        return result
+
+
+def create_session(
+    stats=None,
+    limit=100,
+    limit_per_host=20,
+    dns_ttl=300,
+    keepalive=30,
+    timeout=30,
+):
+    """Creates the shared ClientSession with explicit pool limits, DNS cache
+    TTL, keep-alive and a default timeout instead of aiohttp's defaults."""
+    connector = aiohttp.TCPConnector(
+        limit=limit,
+        limit_per_host=limit_per_host,
+        ttl_dns_cache=dns_ttl,
+        keepalive_timeout=keepalive,
+    )
+    trace_configs = [stats.trace_config()] if stats is not None else None
+    return aiohttp.ClientSession(
+        connector=connector,
+        timeout=aiohttp.ClientTimeout(total=timeout),
+        trace_configs=trace_configs,
+    )
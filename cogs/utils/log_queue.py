@@ -0,0 +1,114 @@
+import logging
+import queue
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+
+class RepeatFilter(logging.Filter):
+    """Lets through at most ``limit`` records from one logging call site per
+    ``window`` seconds. The first record after a quiet window says how many
+    were suppressed, so an outage shows up as a few lines instead of
+    thousands of identical ones."""
+
+    def __init__(self, limit=10, window=60.0):
+        super().__init__()
+        self.limit = limit
+        self.window = window
+        self.suppressed = 0
+        self._sites = {}
+
+    def filter(self, record):
+        now = time.monotonic()
+        key = (record.pathname, record.lineno, record.levelno)
+        site = self._sites.get(key)
+        if site is None or now - site[0] >= self.window:
+            skipped = site[2] if site is not None else 0
+            self._sites[key] = [now, 1, 0]
+            if skipped:
+                record.msg = f"{record.msg} ({skipped} similar messages suppressed)"
+            return True
+
+        if site[1] < self.limit:
+            site[1] += 1
+            return True
+        site[2] += 1
+        self.suppressed += 1
+        return False
+
+
+class LogQueueHandler(QueueHandler):
+    """Hands records to a QueueListener thread without ever blocking.
+
+    Records are passed on as they are, so formatting them (tracebacks
+    included) and writing them happen on the listener thread. When the
+    queue is full the record is dropped and counted, and the next record
+    that fits is preceded by a warning saying how many were lost.
+    """
+
+    def __init__(self, maxsize=10000):
+        super().__init__(queue.Queue(maxsize))
+        self.dropped = 0
+        self._reported = 0
+
+    def listen(self, handlers):
+        """Starts a QueueListener passing this queue's records on to
+        ``handlers``. Stop it to write out whatever is still queued."""
+        # Records none of the handlers want shouldn't take up room in the queue
+        self.setLevel(min(h.level for h in handlers))
+        listener = QueueListener(self.queue, *handlers, respect_handler_level=True)
+        listener.start()
+        return listener
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            if self.dropped > self._reported:
+                self.queue.put_nowait(self._dropped_record())
+                self._reported = self.dropped
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _dropped_record(self):
+        return logging.LogRecord(
+            __name__,
+            logging.WARNING,
+            __file__,
+            0,
+            "Dropped %s log records because the log queue was full",
+            (self.dropped - self._reported,),
+            None,
+        )
+
+    def stats(self):
+        return {
+            "queued": self.queue.qsize(),
+            "dropped": self.dropped,
+            "suppressed": sum(
+                f.suppressed for f in self.filters if isinstance(f, RepeatFilter)
+            ),
+        }
+
+    def prometheus(self):
+        """Returns the queue's metrics in Prometheus text format, for
+        Metrics.add_collector."""
+        stats = self.stats()
+        return [
+            "# TYPE cosmo_log_queue_depth gauge",
+            f"cosmo_log_queue_depth {stats['queued']}",
+            "# TYPE cosmo_log_records_dropped_total counter",
+            f"cosmo_log_records_dropped_total {stats['dropped']}",
+            "# TYPE cosmo_log_records_suppressed_total counter",
+            f"cosmo_log_records_suppressed_total {stats['suppressed']}",
+        ]
+
+
+def queue_handler(logger=None):
+    """Returns the LogQueueHandler installed on ``logger`` (the root logger
+    by default), or None if logging is synchronous."""
+    for handler in (logger or logging.getLogger()).handlers:
+        if isinstance(handler, LogQueueHandler):
+            return handler
+    return None
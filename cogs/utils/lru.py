@@ -0,0 +1,108 @@
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class LRUCache:
+    """An in-process LRU cache bounded by entry count and/or total size.
+
+    Entries may expire after ``ttl`` seconds. ``sizeof`` returns the size of a
+    value and is only needed when ``max_bytes`` is set.
+    """
+
+    def __init__(self, max_entries=None, max_bytes=None, ttl=None, sizeof=len):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._sizeof = sizeof
+        self._data = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING, count=False) is not _MISSING
+
+    def get(self, key, default=None, count=True):
+        entry = self._data.get(key)
+        if entry is not None:
+            value, size, expires = entry
+            if expires is None or expires > time.monotonic():
+                self._data.move_to_end(key)
+                if count:
+                    self.hits += 1
+                return value
+            self._remove(key)
+        if count:
+            self.misses += 1
+        return default
+
+    def put(self, key, value, ttl=None):
+        self.pop(key)
+
+        size = self._sizeof(value) if self.max_bytes is not None else 0
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+
+        ttl = ttl if ttl is not None else self.ttl
+        expires = time.monotonic() + ttl if ttl is not None else None
+        self._data[key] = (value, size, expires)
+        self.size += size
+
+        while (self.max_entries is not None and len(self._data) > self.max_entries) or (
+            self.max_bytes is not None and self.size > self.max_bytes
+        ):
+            oldest = next(iter(self._data))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def pop(self, key, default=None):
+        if key not in self._data:
+            return default
+        return self._remove(key)
+
+    def clear(self):
+        self._data.clear()
+        self.size = 0
+
+    def _remove(self, key):
+        value, size, _ = self._data.pop(key)
+        self.size -= size
+        return value
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self):
+        return {
+            "entries": len(self._data),
+            "bytes": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hit_rate,
+        }
+
+    def prometheus(self, name):
+        """Returns this cache's metrics in Prometheus text format, for
+        Metrics.add_collector."""
+        metric = f"cosmo_{name}_cache"
+        return [
+            f"# TYPE {metric}_entries gauge",
+            f"{metric}_entries {len(self._data)}",
+            f"# TYPE {metric}_bytes gauge",
+            f"{metric}_bytes {self.size}",
+            f"# TYPE {metric}_hits_total counter",
+            f"{metric}_hits_total {self.hits}",
+            f"# TYPE {metric}_misses_total counter",
+            f"{metric}_misses_total {self.misses}",
+            f"# TYPE {metric}_evictions_total counter",
+            f"{metric}_evictions_total {self.evictions}",
+        ]
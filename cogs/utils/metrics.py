@@ -0,0 +1,237 @@
+import bisect
+import logging
+import time
+from collections import defaultdict
+
+from aiohttp import web
+
+log = logging.getLogger(__name__)
+
+# Upper bounds in seconds, from a warm cache hit up to a slow Discord upload
+DEFAULT_BUCKETS = (
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+
+class Histogram:
+    """Counts observations into fixed buckets, the way Prometheus expects them."""
+
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        # The last slot is the +Inf bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Estimates a quantile by interpolating inside its bucket, like
+        Prometheus' histogram_quantile."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if seen + n >= rank and n:
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[i - 1] if i else 0.0
+                return lower + (self.buckets[i] - lower) * (rank - seen) / n
+            seen += n
+        return self.buckets[-1]
+
+
+class Span:
+    __slots__ = ("stage", "labels", "seconds")
+
+    def __init__(self, stage, labels):
+        self.stage = stage
+        self.labels = labels
+        self.seconds = 0.0
+
+
+class _Timer:
+    __slots__ = ("_trace", "_span", "_start")
+
+    def __init__(self, trace, span):
+        self._trace = trace
+        self._span = span
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self._span
+
+    def __exit__(self, exc_type, exc, tb):
+        self._span.seconds = time.perf_counter() - self._start
+        self._trace.spans.append(self._span)
+
+
+class Trace:
+    """Timing spans of one request. Used as a context manager, it records
+    every span and the total into its Metrics when the request finishes."""
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+        self.spans = []
+        self._start = None
+
+    def span(self, stage, **labels):
+        """Times the body of a with block. Labels can still be added to the
+        returned Span inside the block, e.g. once the source is known."""
+        return _Timer(self, Span(stage, labels))
+
+    def add(self, stage, seconds, **labels):
+        """Records a span that was timed elsewhere, e.g. in a render worker."""
+        span = Span(stage, labels)
+        span.seconds = seconds
+        self.spans.append(span)
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        total = time.perf_counter() - self._start
+        outcome = "ok" if exc_type is None else exc_type.__name__
+        self.metrics.record(self, total, outcome)
+
+
+class Metrics:
+    """Aggregates request traces into per-stage latency histograms."""
+
+    def __init__(self, slow_threshold=None, buckets=DEFAULT_BUCKETS):
+        self.slow_threshold = slow_threshold
+        self.buckets = buckets
+        # (trace name, stage, sorted label items) -> Histogram
+        self._histograms = defaultdict(lambda: Histogram(self.buckets))
+        self._collectors = []
+
+    def trace(self, name):
+        return Trace(self, name)
+
+    def add_collector(self, collector):
+        """Registers a callable returning extra Prometheus lines, for stats
+        that live elsewhere such as a rate limiter's queue."""
+        self._collectors.append(collector)
+
+    def record(self, trace, total, outcome):
+        for span in trace.spans:
+            key = (trace.name, span.stage, tuple(sorted(span.labels.items())))
+            self._histograms[key].observe(span.seconds)
+        self._histograms[(trace.name, "total", (("outcome", outcome),))].observe(total)
+
+        breakdown = " ".join(
+            f"{span.stage}={span.seconds * 1000:.1f}ms"
+            + "".join(f" {k}={v}" for k, v in span.labels.items())
+            for span in trace.spans
+        )
+        message = "%s trace outcome=%s total=%.1fms %s"
+        if self.slow_threshold is not None and total >= self.slow_threshold:
+            log.warning("Slow " + message, trace.name, outcome, total * 1000, breakdown)
+        else:
+            log.debug(message, trace.name, outcome, total * 1000, breakdown)
+
+    def summary(self, name):
+        """Returns {(stage, labels): stats} for one kind of trace, with the
+        count, mean and estimated p50/p95 in milliseconds."""
+        result = {}
+        for (trace_name, stage, labels), hist in sorted(self._histograms.items()):
+            if trace_name != name:
+                continue
+            result[(stage, labels)] = {
+                "count": hist.count,
+                "avg_ms": hist.sum / hist.count * 1000,
+                "p50_ms": hist.quantile(0.5) * 1000,
+                "p95_ms": hist.quantile(0.95) * 1000,
+            }
+        return result
+
+    def render_prometheus(self):
+        """Serialises every histogram in the Prometheus text exposition format."""
+        by_trace = defaultdict(list)
+        for (name, stage, labels), hist in sorted(self._histograms.items()):
+            by_trace[name].append(((("stage", stage),) + labels, hist))
+
+        lines = []
+        for name, series in by_trace.items():
+            metric = f"cosmo_{name}_stage_seconds"
+            lines.append(
+                f"# HELP {metric} Time spent in each stage of the {name} command"
+            )
+            lines.append(f"# TYPE {metric} histogram")
+            for labels, hist in series:
+                lines += histogram_lines(metric, labels, hist)
+        for collector in self._collectors:
+            lines += collector()
+        return "\n".join(lines) + "\n"
+
+
+def histogram_lines(metric, labels, hist):
+    """The _bucket, _sum and _count lines of one labelled histogram."""
+    lines = []
+    cumulative = 0
+    for bound, n in zip(hist.buckets + (float("inf"),), hist.counts):
+        cumulative += n
+        le = "+Inf" if bound == float("inf") else repr(bound)
+        lines.append(f"{metric}_bucket{_labels(labels + (('le', le),))} {cumulative}")
+    lines.append(f"{metric}_sum{_labels(labels)} {hist.sum}")
+    lines.append(f"{metric}_count{_labels(labels)} {hist.count}")
+    return lines
+
+
+def _labels(items):
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in items) + "}"
+
+
+class MetricsServer:
+    """Serves /metrics for a Prometheus scraper. Binds to localhost by default
+    since the numbers are only meant for whoever runs the bot."""
+
+    def __init__(self, metrics, host="127.0.0.1", port=9100):
+        self.metrics = metrics
+        self.host = host
+        self.port = port
+        self._runner = None
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/metrics", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        log.info("Serving metrics on http://%s:%s/metrics", self.host, self.port)
+
+    async def _handle(self, request):
+        return web.Response(
+            body=self.metrics.render_prometheus().encode(),
+            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+        )
+
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
@@ -0,0 +1,107 @@
+import asyncio
+import logging
+
+import discord
+
+log = logging.getLogger(__name__)
+
+
+class LivePages(discord.ui.View):
+    """A paginated embed that keeps growing while results come in.
+
+    Lines are added with ``add`` at any time and the message is edited at
+    most once every ``edit_interval`` seconds, so a burst of results costs a
+    single edit instead of running into Discord's rate limit. The buttons
+    page through whatever has arrived so far.
+    """
+
+    def __init__(self, author_id, title, per_page=15, edit_interval=2.0, timeout=180):
+        super().__init__(timeout=timeout)
+        self.author_id = author_id
+        self.title = title
+        self.per_page = per_page
+        self.edit_interval = edit_interval
+        self.lines = []
+        self.footer = ""
+        self.page = 0
+        self.message = None
+        self._dirty = False
+        self._refresh_task = None
+
+    @property
+    def pages(self):
+        return max(1, -(-len(self.lines) // self.per_page))
+
+    def add(self, line):
+        self.lines.append(line)
+        self._dirty = True
+
+    def set_footer(self, text):
+        if text != self.footer:
+            self.footer = text
+            self._dirty = True
+
+    def embed(self):
+        start = self.page * self.per_page
+        embed = discord.Embed(title=self.title)
+        embed.description = (
+            "\n".join(self.lines[start : start + self.per_page]) or "Nobody yet."
+        )
+        footer = f"Page {self.page + 1}/{self.pages}"
+        if self.footer:
+            footer += f" · {self.footer}"
+        embed.set_footer(text=footer)
+        self.previous.disabled = self.page == 0
+        self.next.disabled = self.page >= self.pages - 1
+        return embed
+
+    async def start(self, ctx):
+        self.message = await ctx.send(embed=self.embed(), view=self)
+        self._refresh_task = asyncio.get_running_loop().create_task(self._refresh())
+
+    async def finish(self):
+        """Stops the periodic edits and shows the final state. The buttons
+        time out ``timeout`` seconds after this (or after the last update
+        while results are still coming in)."""
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+        await self._edit()
+
+    async def _refresh(self):
+        while True:
+            await asyncio.sleep(self.edit_interval)
+            if self._dirty:
+                await self._edit()
+
+    async def _edit(self):
+        self._dirty = False
+        if self.is_finished():
+            # Sending the view again would bring back buttons nobody listens to
+            view = None
+        else:
+            view = self
+            # Count the timeout from the latest results, not from the start
+            self.timeout = self.timeout
+        try:
+            await self.message.edit(embed=self.embed(), view=view)
+        except discord.HTTPException as e:
+            log.warning("Failed to update pages: %s", e)
+
+    async def interaction_check(self, interaction):
+        return interaction.user.id == self.author_id
+
+    async def on_timeout(self):
+        try:
+            await self.message.edit(view=None)
+        except discord.HTTPException:
+            pass
+
+    @discord.ui.button(label="◀", style=discord.ButtonStyle.secondary)
+    async def previous(self, interaction, button):
+        self.page = max(0, self.page - 1)
+        await interaction.response.edit_message(embed=self.embed(), view=self)
+
+    @discord.ui.button(label="▶", style=discord.ButtonStyle.secondary)
+    async def next(self, interaction, button):
+        self.page = min(self.pages - 1, self.page + 1)
+        await interaction.response.edit_message(embed=self.embed(), view=self)
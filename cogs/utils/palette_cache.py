@@ -0,0 +1,112 @@
+import logging
+
+import asyncpg
+
+from .lru import LRUCache
+
+log = logging.getLogger(__name__)
+
+# Bump whenever a change to dominant_colors.py can change the palette it
+# returns for the same image, so stale rows are never served
+PALETTE_VERSION = 1
+
+
+def palette_key(digest, color_mode, clusters=5):
+    """Builds a key from the DecodedImage digest of the album artwork."""
+    return f"{digest}:{color_mode}:{clusters}:v{PALETTE_VERSION}"
+
+
+class PaletteCache:
+    """Caches (primary, secondary) palettes in an in-process LRU in front of
+    the palette_cache table, so each piece of artwork is clustered once."""
+
+    def __init__(self, pool, max_entries=4096, max_rows=100_000, prune_every=1000):
+        self._pool = pool
+        self._memory = LRUCache(max_entries=max_entries)
+        self.max_rows = max_rows
+        self._prune_every = prune_every
+        self._writes = 0
+        self._db_enabled = True
+        self.db_hits = 0
+        self.db_misses = 0
+
+    async def get(self, key):
+        palette = self._memory.get(key)
+        if palette is not None or not self._db_enabled:
+            return palette
+
+        # Reading through an UPDATE keeps last_used current for eviction in a
+        # single round trip
+        query = """UPDATE palette_cache SET last_used = now()
+                    WHERE key = $1
+                    RETURNING primary_color, secondary_color"""
+        try:
+            async with self._pool.acquire() as connection:
+                row = await connection.fetchrow(query, key)
+        except Exception as e:
+            self._handle_db_error(e)
+            return None
+
+        if row is None:
+            self.db_misses += 1
+            return None
+
+        self.db_hits += 1
+        palette = (list(row["primary_color"]), list(row["secondary_color"]))
+        self._memory.put(key, palette)
+        return palette
+
+    async def put(self, key, palette):
+        primary, secondary = palette
+        self._memory.put(key, (list(primary), list(secondary)))
+        if not self._db_enabled:
+            return
+
+        query = """INSERT INTO palette_cache (key, primary_color, secondary_color)
+                    VALUES ($1, $2, $3)
+                    ON CONFLICT (key) DO UPDATE SET last_used = now()"""
+        try:
+            async with self._pool.acquire() as connection:
+                await connection.execute(query, key, list(primary), list(secondary))
+        except Exception as e:
+            self._handle_db_error(e)
+            return
+
+        self._writes += 1
+        if self._writes % self._prune_every == 0:
+            await self.prune()
+
+    async def prune(self):
+        """Deletes the least recently used rows beyond max_rows."""
+        query = """DELETE FROM palette_cache WHERE key IN (
+                    SELECT key FROM palette_cache ORDER BY last_used DESC OFFSET $1)"""
+        try:
+            async with self._pool.acquire() as connection:
+                status = await connection.execute(query, self.max_rows)
+            log.info("Pruned palette cache: %s", status)
+        except Exception as e:
+            self._handle_db_error(e)
+
+    def _handle_db_error(self, error):
+        if isinstance(error, asyncpg.UndefinedTableError):
+            log.error("palette_cache table is missing, caching palettes in memory only")
+            self._db_enabled = False
+        else:
+            log.warning("Palette cache database error: %s", error)
+
+    def stats(self):
+        return {
+            **self._memory.stats(),
+            "db_hits": self.db_hits,
+            "db_misses": self.db_misses,
+        }
+
+    def prometheus(self):
+        """Returns the cache's metrics in Prometheus text format, for
+        Metrics.add_collector."""
+        return self._memory.prometheus("palette") + [
+            "# TYPE cosmo_palette_cache_db_hits_total counter",
+            f"cosmo_palette_cache_db_hits_total {self.db_hits}",
+            "# TYPE cosmo_palette_cache_db_misses_total counter",
+            f"cosmo_palette_cache_db_misses_total {self.db_misses}",
+        ]
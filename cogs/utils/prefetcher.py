@@ -0,0 +1,142 @@
+import asyncio
+import logging
+import random
+import time
+from collections import OrderedDict
+
+from discord.ext import commands
+
+from .palette_cache import palette_key
+from .rate_limit import BACKGROUND
+
+log = logging.getLogger(__name__)
+
+
+class _Watched:
+    __slots__ = ("username", "last_active", "next_poll", "last_track")
+
+    def __init__(self, username, now):
+        self.username = username
+        self.last_active = now
+        self.next_poll = now
+        self.last_track = None
+
+
+class NowPlayingPrefetcher:
+    """Polls Last.fm for users who recently used .fmi and, when their track
+    changes, fetches the new artwork and computes its palette ahead of time so
+    their next .fmi only has to composite.
+
+    At most ``max_users`` users are watched, each for ``active_window``
+    seconds after their last .fmi. Polls are jittered around ``interval`` and
+    never exceed ``calls_per_minute`` in total.
+    """
+
+    def __init__(
+        self,
+        cog,
+        max_users=200,
+        active_window=30 * 60,
+        interval=60,
+        calls_per_minute=30,
+    ):
+        if calls_per_minute <= 0:
+            raise ValueError(
+                f"calls_per_minute must be positive, not {calls_per_minute!r}"
+            )
+        self._cog = cog
+        self._bot = cog.bot
+        self.max_users = max_users
+        self.active_window = active_window
+        self.interval = interval
+        self._spacing = 60 / calls_per_minute
+        self._watched = OrderedDict()
+        self._task = None
+        self._last_call = 0.0
+        self.polls = 0
+        self.prefetches = 0
+
+    def touch(self, lastfm_username):
+        """Marks a user as active, adding them to the working set."""
+        now = time.monotonic()
+        key = lastfm_username.casefold()
+        watched = self._watched.get(key)
+        if watched is None:
+            watched = self._watched[key] = _Watched(lastfm_username, now)
+            # They were just looked up by .fmi, so there's nothing to do yet
+            watched.next_poll = now + self._jittered()
+            while len(self._watched) > self.max_users:
+                self._watched.popitem(last=False)
+        else:
+            watched.last_active = now
+            self._watched.move_to_end(key)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def _jittered(self):
+        return self.interval * random.uniform(0.75, 1.25)
+
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            for key in [
+                key
+                for key, watched in self._watched.items()
+                if now - watched.last_active > self.active_window
+            ]:
+                del self._watched[key]
+
+            if not self._watched:
+                await asyncio.sleep(self.interval / 4)
+                continue
+
+            watched = min(self._watched.values(), key=lambda w: w.next_poll)
+            wake = max(watched.next_poll, self._last_call + self._spacing)
+            if wake > now:
+                await asyncio.sleep(wake - now)
+                # The working set may have changed while sleeping
+                continue
+
+            self._last_call = time.monotonic()
+            watched.next_poll = self._last_call + self._jittered()
+            try:
+                await self._poll(watched)
+            except Exception:
+                log.exception("Prefetch failed for %s", watched.username)
+
+    async def _poll(self, watched):
+        self.polls += 1
+        try:
+            lastfmdata = await self._cog._get_lastfm_info(watched.username, BACKGROUND)
+        except commands.CommandError:
+            return
+
+        if lastfmdata == watched.last_track:
+            return
+        watched.last_track = lastfmdata
+
+        album = await self._cog._get_album_art(
+            lastfmdata.artist, lastfmdata.album, lastfmdata.albumartlink
+        )
+        if album is None:
+            return
+
+        key = palette_key(album.digest, self._bot.render_pool.color_mode)
+        if await self._bot.palette_cache.get(key) is None:
+            palette = await self._bot.render_pool.palette(album)
+            await self._bot.palette_cache.put(key, palette)
+        self.prefetches += 1
+
+    def stats(self):
+        return {
+            "watched": len(self._watched),
+            "polls": self.polls,
+            "prefetches": self.prefetches,
+        }
@@ -0,0 +1,205 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+from .metrics import Histogram, histogram_lines
+
+log = logging.getLogger(__name__)
+
+# Lower runs first: someone waiting on .fmi beats .listening beats prefetching
+INTERACTIVE = 0
+BULK = 1
+BACKGROUND = 2
+
+_PRIORITY_NAMES = {INTERACTIVE: "interactive", BULK: "bulk", BACKGROUND: "background"}
+
+
+class RateLimitTimeout(Exception):
+    """Raised when a request waited longer than max_wait for its turn."""
+
+
+class Ticket:
+    """One request's place in a RateLimiter queue. Pass the same ticket to
+    every ``acquire`` for that request, so ``promote`` can move it ahead
+    when a more urgent caller comes to depend on it."""
+
+    __slots__ = ("priority", "_future")
+
+    def __init__(self, priority=INTERACTIVE):
+        self.priority = priority
+        self._future = None
+
+
+class RateLimiter:
+    """A token bucket shared by every request made with one API key.
+
+    Up to ``burst`` requests go out at once, after that ``rate`` per second.
+    Callers that find the bucket empty queue by priority, then arrival, for at
+    most ``max_wait`` seconds. When the API says it is rate limited,
+    ``backoff`` pauses everyone, doubling the pause on each consecutive
+    complaint until ``success`` is reported again.
+    """
+
+    def __init__(self, rate=5.0, burst=10, max_wait=10.0, max_backoff=60.0):
+        self.rate = rate
+        self.burst = burst
+        self.max_wait = max_wait
+        self.max_backoff = max_backoff
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._backoff = 0.0
+        self._waiters = []
+        self._sequence = itertools.count()
+        self._wake = asyncio.Event()
+        self._dispatcher = None
+        self.waits = {name: Histogram() for name in _PRIORITY_NAMES.values()}
+        self.max_queued = 0
+        self.throttled = 0
+        self.timeouts = 0
+
+    @property
+    def queued(self):
+        # A promoted waiter is in the heap twice, under both priorities
+        return len({id(f) for _, _, f in self._waiters if not f.done()})
+
+    async def acquire(self, priority=INTERACTIVE, max_wait=None, ticket=None):
+        """Waits until a request may be sent. Raises RateLimitTimeout if that
+        takes longer than max_wait seconds (the limiter's default if None).
+        With a ticket, its priority is used instead of ``priority``."""
+        if ticket is not None:
+            priority = ticket.priority
+        start = time.monotonic()
+        histogram = self.waits[_PRIORITY_NAMES[priority]]
+        if not self._waiters and self._take(start):
+            histogram.observe(0.0)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        if ticket is not None:
+            ticket._future = future
+        heapq.heappush(self._waiters, (priority, next(self._sequence), future))
+        self.max_queued = max(self.max_queued, len(self._waiters))
+        self._ensure_dispatcher()
+        self._wake.set()
+        try:
+            await asyncio.wait_for(future, max_wait or self.max_wait)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise RateLimitTimeout from None
+        finally:
+            # A cancelled or timed out waiter is skipped by the dispatcher
+            histogram.observe(time.monotonic() - start)
+
+    def promote(self, ticket, priority):
+        """Raises a ticket's priority, moving its request ahead in the queue
+        if it is waiting right now."""
+        if priority >= ticket.priority:
+            return
+        ticket.priority = priority
+        future = ticket._future
+        if future is not None and not future.done():
+            # The old entry stays behind and is skipped once this one is served
+            heapq.heappush(self._waiters, (priority, next(self._sequence), future))
+            self._wake.set()
+
+    def backoff(self, retry_after=None):
+        """Pauses all requests after the API reported a rate limit."""
+        self.throttled += 1
+        if retry_after is not None:
+            # A huge Retry-After would stall .fmi along with everything else
+            delay = min(retry_after, self.max_backoff)
+        else:
+            delay = min(max(self._backoff * 2, 1.0), self.max_backoff)
+        self._backoff = delay
+        self._blocked_until = max(self._blocked_until, time.monotonic() + delay)
+        # Whatever was saved up is clearly too much right now
+        self._tokens = 0.0
+        log.warning("Rate limited, pausing requests for %.1fs", delay)
+
+    def success(self):
+        self._backoff = 0.0
+
+    def close(self):
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            self._dispatcher = None
+
+    def _refill(self, now):
+        # Nothing builds up during a pause, or it would end with a full burst
+        since = max(self._updated, self._blocked_until)
+        self._tokens = min(self.burst, self._tokens + max(0.0, now - since) * self.rate)
+        self._updated = now
+
+    def _take(self, now):
+        if now < self._blocked_until:
+            return False
+        self._refill(now)
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+    def _ensure_dispatcher(self):
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.get_running_loop().create_task(self._dispatch())
+
+    async def _dispatch(self):
+        while True:
+            while self._waiters and self._waiters[0][2].done():
+                heapq.heappop(self._waiters)
+            if not self._waiters:
+                self._wake.clear()
+                await self._wake.wait()
+                continue
+
+            now = time.monotonic()
+            if self._take(now):
+                _, _, future = heapq.heappop(self._waiters)
+                future.set_result(None)
+                continue
+
+            if now < self._blocked_until:
+                delay = self._blocked_until - now
+            else:
+                delay = (1 - self._tokens) / self.rate
+            await asyncio.sleep(delay)
+
+    def stats(self):
+        return {
+            "queued": self.queued,
+            "max_queued": self.max_queued,
+            "tokens": self._tokens,
+            "paused_for": max(0.0, self._blocked_until - time.monotonic()),
+            "throttled": self.throttled,
+            "timeouts": self.timeouts,
+            "waits": {
+                name: {
+                    "count": hist.count,
+                    "p50_ms": hist.quantile(0.5) * 1000,
+                    "p95_ms": hist.quantile(0.95) * 1000,
+                }
+                for name, hist in self.waits.items()
+            },
+        }
+
+    def prometheus(self, name):
+        """Returns this limiter's metrics in Prometheus text format, for
+        Metrics.add_collector."""
+        metric = f"cosmo_{name}_rate_limit"
+        lines = [
+            f"# TYPE {metric}_queued gauge",
+            f"{metric}_queued {self.queued}",
+            f"# TYPE {metric}_throttled_total counter",
+            f"{metric}_throttled_total {self.throttled}",
+            f"# TYPE {metric}_timeouts_total counter",
+            f"{metric}_timeouts_total {self.timeouts}",
+            f"# TYPE {metric}_wait_seconds histogram",
+        ]
+        for priority, hist in self.waits.items():
+            lines += histogram_lines(
+                f"{metric}_wait_seconds", (("priority", priority),), hist
+            )
+        return lines
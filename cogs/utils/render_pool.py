@@ -0,0 +1,240 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import NamedTuple
+
+log = logging.getLogger(__name__)
+
+
+class RenderResult(NamedTuple):
+    image: bytes
+    # For stacked renders, one palette per card
+    palette: tuple
+    # Seconds spent in each stage inside the worker: colors (only when no
+    # palette was passed in), composite and encode
+    timings: dict
+    # (pid, FmiText.layout_stats()) of the worker that rendered the image
+    worker: tuple
+
+
+def render_key(lastfmdata, album_digest, avatar_key, color_mode, output_profile):
+    """Identifies a finished render, for caching the encoded image."""
+    from .fmi_builder import RENDERER_VERSION
+
+    return (
+        lastfmdata.title,
+        lastfmdata.artist,
+        lastfmdata.album,
+        album_digest,
+        avatar_key,
+        color_mode,
+        output_profile,
+        RENDERER_VERSION,
+    )
+
+
+def _init_worker():
+    # Load the font database, OpenCV and scikit-learn once per worker process
+    # rather than on every render. Each worker is single threaded so that N
+    # workers use N cores instead of fighting over OpenMP threads.
+    import cv2
+    from threadpoolctl import threadpool_limits
+
+    from . import dominant_colors, fmi_builder, fmi_text  # noqa: F401
+
+    dominant_colors.preload()
+    cv2.setNumThreads(1)
+    threadpool_limits(limits=1)
+
+
+def _warmup():
+    return os.getpid()
+
+
+def _render(album, avatar_tile, lastfmdata, color_mode, output_profile, palette):
+    from .dominant_colors import COLOR_MODES
+    from .fmi_builder import FmiBuilder
+    from .fmi_text import FmiText
+
+    timings = {}
+    start = time.perf_counter()
+    if palette is None:
+        palette = COLOR_MODES[color_mode](album.rgba)
+        timings["colors"] = time.perf_counter() - start
+        start = time.perf_counter()
+
+    text = FmiText(lastfmdata)
+    builder = FmiBuilder(album, avatar_tile, text, palette=palette)
+    image = builder.compose()
+    timings["composite"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    encoded = builder.encode(image, output_profile).getvalue()
+    timings["encode"] = time.perf_counter() - start
+    return RenderResult(
+        encoded, builder.palette, timings, (os.getpid(), FmiText.layout_stats())
+    )
+
+
+def _render_stack(cards, color_mode, output_profile):
+    from .dominant_colors import COLOR_MODES
+    from .fmi_builder import FmiBuilder
+    from .fmi_text import FmiText
+
+    timings = {"colors": 0.0, "composite": 0.0}
+    # Cards sharing an album are clustered once
+    palettes = {}
+    for album, _, _, palette in cards:
+        if palette is not None:
+            palettes.setdefault(album.digest, palette)
+    for album, _, _, _ in cards:
+        if album.digest not in palettes:
+            start = time.perf_counter()
+            palettes[album.digest] = COLOR_MODES[color_mode](album.rgba)
+            timings["colors"] += time.perf_counter() - start
+
+    images = []
+    start = time.perf_counter()
+    for album, avatar_tile, lastfmdata, _ in cards:
+        text = FmiText(lastfmdata)
+        builder = FmiBuilder(album, avatar_tile, text, palette=palettes[album.digest])
+        images.append(builder.compose())
+    image = FmiBuilder.stack(images)
+    timings["composite"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    encoded = FmiBuilder.encode(image, output_profile).getvalue()
+    timings["encode"] = time.perf_counter() - start
+    return RenderResult(
+        encoded,
+        tuple(palettes[album.digest] for album, _, _, _ in cards),
+        timings,
+        (os.getpid(), FmiText.layout_stats()),
+    )
+
+
+def _palette(album, color_mode):
+    from .dominant_colors import COLOR_MODES
+
+    return COLOR_MODES[color_mode](album.rgba)
+
+
+class RenderPool:
+    """Runs FmiBuilder in a pool of worker processes so that clustering,
+    resizing and PNG encoding never block the event loop."""
+
+    def __init__(self, workers=None, color_mode="exact", output_profile="png"):
+        from .dominant_colors import COLOR_MODES
+        from .fmi_builder import OUTPUT_PROFILES
+
+        if color_mode not in COLOR_MODES:
+            raise ValueError(f"Unknown color mode {color_mode!r}")
+        if output_profile not in OUTPUT_PROFILES:
+            raise ValueError(f"Unknown output profile {output_profile!r}")
+        self.workers = workers or os.cpu_count() or 1
+        self.color_mode = color_mode
+        self.output_profile = output_profile
+        # File extension Discord needs to display the image inline
+        self.extension = OUTPUT_PROFILES[output_profile].extension
+        self._layout_stats = {}
+        self._encoded = 0
+        self._encoded_bytes = 0
+        self._encode_seconds = 0.0
+        self._executor = self._create_executor()
+
+    def _create_executor(self):
+        # spawn rather than fork: the parent has a running event loop and
+        # aiohttp's resolver threads, neither of which survive a fork cleanly
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+        )
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        pids = await asyncio.gather(
+            *(
+                loop.run_in_executor(self._executor, _warmup)
+                for _ in range(self.workers)
+            )
+        )
+        log.info("Render pool started with %s workers", len(set(pids)))
+
+    async def render(self, album, avatar_tile, lastfmdata, palette=None):
+        """Renders an fmi from a DecodedImage album and returns a
+        RenderResult. Clustering is skipped when a cached palette is passed."""
+        result = await self._submit(
+            _render,
+            album,
+            avatar_tile,
+            lastfmdata,
+            self.color_mode,
+            self.output_profile,
+            palette,
+        )
+        self._record(result)
+        return result
+
+    async def render_stack(self, cards):
+        """Renders several fmis stacked into one image. cards is a list of
+        (album, avatar_tile, lastfmdata, palette) and palette may be None.
+        The same DecodedImage can appear on several cards, it is sent to the
+        worker and clustered only once."""
+        result = await self._submit(
+            _render_stack, cards, self.color_mode, self.output_profile
+        )
+        self._record(result)
+        return result
+
+    def _record(self, result):
+        pid, stats = result.worker
+        self._layout_stats[pid] = stats
+        self._encoded += 1
+        self._encoded_bytes += len(result.image)
+        self._encode_seconds += result.timings["encode"]
+
+    def output_stats(self):
+        """Average encode time and size of the images rendered so far."""
+        n = self._encoded
+        return {
+            "profile": self.output_profile,
+            "renders": n,
+            "avg_kb": self._encoded_bytes / n / 1024 if n else 0.0,
+            "avg_encode_ms": self._encode_seconds / n * 1000 if n else 0.0,
+        }
+
+    def layout_stats(self):
+        """Text layout cache stats summed over the workers, as of the last
+        render each of them did."""
+        hits = sum(s["hits"] for s in self._layout_stats.values())
+        misses = sum(s["misses"] for s in self._layout_stats.values())
+        return {
+            "workers": len(self._layout_stats),
+            "entries": sum(s["entries"] for s in self._layout_stats.values()),
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+        }
+
+    async def palette(self, album):
+        """Computes only the (primary, secondary) palette of a DecodedImage."""
+        return await self._submit(_palette, album, self.color_mode)
+
+    async def _submit(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self._executor, fn, *args)
+        except BrokenProcessPool:
+            log.error("Render worker died, restarting the render pool")
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = self._create_executor()
+            self._layout_stats.clear()
+            raise
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,52 @@
+import asyncio
+
+
+class SingleFlight:
+    """Lets concurrent callers asking for the same key share one call.
+
+    The first caller for a key starts the call; callers arriving while it is
+    still running await the same result (or exception) instead of starting
+    their own. With ``cancel_abandoned`` the call is cancelled once every
+    caller waiting on it has given up, instead of running on for nobody.
+    """
+
+    def __init__(self, cancel_abandoned=False):
+        self.cancel_abandoned = cancel_abandoned
+        self._inflight = {}
+        self.calls = 0
+        self.shared = 0
+
+    async def do(self, key, fn, *args, **kwargs):
+        entry = self._inflight.get(key)
+        if entry is not None:
+            self.shared += 1
+        else:
+            task = asyncio.ensure_future(fn(*args, **kwargs))
+            task.add_done_callback(lambda t: self._finished(key, t))
+            entry = self._inflight[key] = [task, 0]
+            self.calls += 1
+
+        task = entry[0]
+        entry[1] += 1
+        try:
+            # shield so one caller giving up doesn't cancel the call for the rest
+            return await asyncio.shield(task)
+        finally:
+            entry[1] -= 1
+            if self.cancel_abandoned and not entry[1] and not task.done():
+                # Forget it right away so a new caller doesn't join a
+                # call that is being cancelled
+                if self._inflight.get(key) is entry:
+                    del self._inflight[key]
+                task.cancel()
+
+    def _finished(self, key, task):
+        entry = self._inflight.get(key)
+        if entry is not None and entry[0] is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            # Mark the exception as retrieved in case every caller went away
+            task.exception()
+
+    def __len__(self):
+        return len(self._inflight)
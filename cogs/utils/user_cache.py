@@ -0,0 +1,160 @@
+import asyncio
+import logging
+import uuid
+
+from .lru import LRUCache
+
+log = logging.getLogger(__name__)
+
+NOTIFY_CHANNEL = "cosmo_discord_users"
+
+_MISSING = object()
+
+
+class UserCache:
+    """Caches the discord table's Discord id -> Last.fm username mapping.
+
+    Unregistered ids are cached too. Writers call ``notify`` inside the
+    writing transaction and every bot process LISTENs on NOTIFY_CHANNEL to
+    drop the entry, so other processes never serve a stale username. While
+    the LISTEN connection is down lookups go straight to the database.
+
+    Every invalidation bumps a version, and a row read from the database is
+    only cached if the version didn't change while it was being read. So a
+    slow read can't put back a username that was changed in the meantime.
+    """
+
+    def __init__(self, pool, max_entries=100_000):
+        self._pool = pool
+        self._cache = LRUCache(max_entries=max_entries)
+        self._instance = uuid.uuid4().hex
+        self._listener = None
+        self._listen_task = None
+        self._version = 0
+
+    async def start(self, preload=False):
+        if preload:
+            query = "SELECT id, username FROM discord LIMIT $1;"
+            async with self._pool.acquire() as connection:
+                rows = await connection.fetch(query, self._cache.max_entries)
+            for row in rows:
+                self._cache.put(row["id"], row["username"])
+            log.info("Preloaded %s Last.fm usernames", len(rows))
+
+        await self._listen()
+
+    async def close(self):
+        if self._listen_task is not None:
+            self._listen_task.cancel()
+        if self._listener is not None:
+            await self._pool.release(self._listener)
+            self._listener = None
+
+    async def get(self, discord_id):
+        # Without a LISTEN connection other processes' writes would be missed
+        if self._listener is not None:
+            username = self._cache.get(discord_id, _MISSING)
+            if username is not _MISSING:
+                return username
+
+        version = self._version
+        query = "SELECT username FROM discord WHERE id = $1;"
+        async with self._pool.acquire() as connection:
+            row = await connection.fetchrow(query, discord_id)
+        username = row.get("username") if row else None
+        if self._can_remember(version):
+            self._cache.put(discord_id, username)
+        return username
+
+    async def get_many(self, discord_ids, remember_missing=True):
+        """Returns {discord_id: username or None}, looking up every id the
+        cache can't answer in a single query. Pass remember_missing=False
+        for whole-guild lookups, so thousands of unregistered ids don't push
+        real users out of the cache."""
+        result = {}
+        missing = []
+        for discord_id in discord_ids:
+            username = _MISSING
+            if self._listener is not None:
+                username = self._cache.get(discord_id, _MISSING)
+            if username is _MISSING:
+                missing.append(discord_id)
+            else:
+                result[discord_id] = username
+
+        if missing:
+            version = self._version
+            query = "SELECT id, username FROM discord WHERE id = ANY($1::bigint[]);"
+            async with self._pool.acquire() as connection:
+                rows = await connection.fetch(query, missing)
+            found = {row["id"]: row["username"] for row in rows}
+            remember = self._can_remember(version)
+            for discord_id in missing:
+                result[discord_id] = found.get(discord_id)
+                if remember and (remember_missing or result[discord_id] is not None):
+                    self._cache.put(discord_id, result[discord_id])
+        return result
+
+    def put(self, discord_id, username):
+        """Writes through a username this process just committed."""
+        self._version += 1
+        self._cache.put(discord_id, username)
+
+    def _can_remember(self, version):
+        # Without a LISTEN connection other processes' writes would be missed,
+        # and a changed version means the row read may already be stale
+        return self._listener is not None and version == self._version
+
+    async def notify(self, connection, discord_id):
+        """Tells every bot process that discord_id changed. Call it inside the
+        transaction that writes the row, Postgres delivers it on commit."""
+        await connection.execute(
+            "SELECT pg_notify($1, $2);",
+            NOTIFY_CHANNEL,
+            f"{self._instance}:{discord_id}",
+        )
+
+    def stats(self):
+        return self._cache.stats()
+
+    async def _listen(self):
+        # LISTEN needs a connection of its own for as long as the bot runs
+        self._listener = await self._pool.acquire()
+        self._listener.add_termination_listener(self._on_terminated)
+        await self._listener.add_listener(NOTIFY_CHANNEL, self._on_notify)
+
+    def _on_notify(self, connection, pid, channel, payload):
+        instance, _, discord_id = payload.partition(":")
+        if instance != self._instance:
+            self._version += 1
+            self._cache.pop(int(discord_id))
+
+    def _on_terminated(self, connection):
+        log.warning("Lost the user cache LISTEN connection, reconnecting")
+        # Changes made while disconnected would be missed, so start over
+        self._version += 1
+        self._cache.clear()
+        self._listener = None
+        self._listen_task = asyncio.get_running_loop().create_task(
+            self._relisten(connection)
+        )
+
+    async def _relisten(self, old_connection):
+        try:
+            await self._pool.release(old_connection)
+        except Exception:
+            pass
+
+        delay = 1
+        while True:
+            try:
+                await self._listen()
+                # Writes between losing the connection and LISTENing again
+                # were never delivered, so nothing cached since can be trusted
+                self._version += 1
+                self._cache.clear()
+                return
+            except Exception as e:
+                log.warning("Failed to re-LISTEN for user cache: %s", e)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 60)
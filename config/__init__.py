@@ -11,3 +11,89 @@ USER_AGENT = os.getenv("USER_AGENT")
 DISCORD_TOKEN = os.getenv("DISCORD_TOKEN")
 SPOTIFY_CLIENT_ID = os.getenv("SPOTIFY_CLIENT_ID")
 SPOTIFY_CLIENT_SECRET = os.getenv("SPOTIFY_CLIENT_SECRET")
+
+# Gateway shards in total, 0 uses Discord's recommendation. SHARD_IDS picks the
+# ones this machine runs (e.g. "0-7,16-23") when several machines share them
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", 0))
+SHARD_IDS = os.getenv("SHARD_IDS")
+# Don't cache guild members, for bots in many large servers. Mentioned members
+# still resolve, .servers shows approximate totals and .listening fetches the
+# member list each time it runs
+LOW_MEMORY = int(os.getenv("LOW_MEMORY", 0))
+# Processes the launcher splits this machine's shards across, 1 runs them all in one
+CLUSTERS = int(os.getenv("CLUSTERS", 1))
+
+# Number of render worker processes, 0 uses one per CPU core
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", 0))
+# Palette extraction used for renders: "exact", "fast" (thumbnail + MiniBatchKMeans) or "v2"
+COLOR_MODE = os.getenv("COLOR_MODE", "exact")
+# How finished images are encoded: "png", "png_fast", "png_palette", "webp" or "webp_lossy"
+OUTPUT_PROFILE = os.getenv("OUTPUT_PROFILE", "png")
+
+# Palettes kept in memory, and rows kept in the palette_cache table
+PALETTE_CACHE_SIZE = int(os.getenv("PALETTE_CACHE_SIZE", 4096))
+PALETTE_CACHE_ROWS = int(os.getenv("PALETTE_CACHE_ROWS", 100000))
+
+# Album artwork cache: memory budget, lifetime of hits and of known misses in
+# seconds, and an optional directory for a persistent on-disk tier
+ARTWORK_CACHE_MB = int(os.getenv("ARTWORK_CACHE_MB", 64))
+ARTWORK_CACHE_TTL = int(os.getenv("ARTWORK_CACHE_TTL", 7 * 24 * 3600))
+ARTWORK_NEGATIVE_TTL = int(os.getenv("ARTWORK_NEGATIVE_TTL", 6 * 3600))
+ARTWORK_CACHE_DIR = os.getenv("ARTWORK_CACHE_DIR")
+
+# Memory used to keep finished images for repeated identical .fmi calls, in megabytes
+RENDER_CACHE_MB = int(os.getenv("RENDER_CACHE_MB", 32))
+
+# Last.fm API requests per second shared by everything using the API key, the
+# burst allowed on top, and seconds a request may queue before it fails
+LASTFM_RATE = float(os.getenv("LASTFM_RATE", 5))
+LASTFM_BURST = int(os.getenv("LASTFM_BURST", 10))
+LASTFM_MAX_WAIT = float(os.getenv("LASTFM_MAX_WAIT", 10))
+
+# Seconds a user's parsed now playing track is reused before asking Last.fm again
+LASTFM_CACHE_TTL = float(os.getenv("LASTFM_CACHE_TTL", 5))
+
+# Discord id -> Last.fm username mappings cached in memory, optionally loaded at startup
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", 100000))
+USER_CACHE_PRELOAD = int(os.getenv("USER_CACHE_PRELOAD", 0))
+
+# Finished 64x64 avatar tiles cached in memory, bounded by count and megabytes
+AVATAR_CACHE_SIZE = int(os.getenv("AVATAR_CACHE_SIZE", 10000))
+AVATAR_CACHE_MB = int(os.getenv("AVATAR_CACHE_MB", 64))
+
+# Shared HTTP session: total and per-host connection limits, DNS cache TTL,
+# idle keep-alive and default request timeout, all in seconds
+HTTP_LIMIT = int(os.getenv("HTTP_LIMIT", 100))
+HTTP_LIMIT_PER_HOST = int(os.getenv("HTTP_LIMIT_PER_HOST", 20))
+HTTP_DNS_TTL = int(os.getenv("HTTP_DNS_TTL", 300))
+HTTP_KEEPALIVE = float(os.getenv("HTTP_KEEPALIVE", 30))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", 30))
+
+# Background prefetching of artwork and palettes for users who recently used .fmi.
+# PREFETCH_CALLS_PER_MINUTE is shared by all clusters, 0 disables prefetching too
+PREFETCH_ENABLED = int(os.getenv("PREFETCH_ENABLED", 0))
+PREFETCH_MAX_USERS = int(os.getenv("PREFETCH_MAX_USERS", 200))
+PREFETCH_INTERVAL = float(os.getenv("PREFETCH_INTERVAL", 60))
+PREFETCH_CALLS_PER_MINUTE = int(os.getenv("PREFETCH_CALLS_PER_MINUTE", 30))
+
+# Optional Prometheus endpoint with per-stage .fmi latencies, 0 disables it.
+# Requests slower than METRICS_SLOW_MS are logged with their stage breakdown
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_SLOW_MS = float(os.getenv("METRICS_SLOW_MS", 3000))
+
+# Members a single .fmi can stack into one image, and how many of their
+# Last.fm, artwork and avatar requests may run at once
+FMI_MAX_USERS = int(os.getenv("FMI_MAX_USERS", 10))
+FMI_CONCURRENCY = int(os.getenv("FMI_CONCURRENCY", 4))
+
+# .listening: Last.fm lookups running at once, and seconds before one is given up on
+LISTENING_CONCURRENCY = int(os.getenv("LISTENING_CONCURRENCY", 4))
+LISTENING_TIMEOUT = float(os.getenv("LISTENING_TIMEOUT", 5))
+
+# Log records waiting for the background writer thread, 0 writes them on the
+# calling thread. One logging call writes at most LOG_REPEAT_LIMIT records per
+# LOG_REPEAT_WINDOW seconds and counts the rest, 0 lets everything through
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+LOG_REPEAT_LIMIT = int(os.getenv("LOG_REPEAT_LIMIT", 10))
+LOG_REPEAT_WINDOW = float(os.getenv("LOG_REPEAT_WINDOW", 60))
@@ -1,14 +1,62 @@
 import asyncio
+import atexit
+import functools
 import logging
 import os
+import signal
 from logging.handlers import RotatingFileHandler
 
 import config
 from bot import Cosmo
+from cogs.utils.cluster import (
+    IDENTIFY_INTERVAL,
+    ClusterSupervisor,
+    fetch_gateway_info,
+    parse_shard_ids,
+    split_shards,
+)
+from cogs.utils.log_queue import LogQueueHandler, RepeatFilter
 
+log = logging.getLogger(__name__)
 
-async def main():
+
+def main():
     setup_logging()
+    shard_ids = parse_shard_ids(config.SHARD_IDS) if config.SHARD_IDS else None
+    if shard_ids and not config.SHARD_COUNT:
+        raise SystemExit("SHARD_IDS needs SHARD_COUNT to be set as well")
+
+    if config.CLUSTERS <= 1:
+        asyncio.run(run_bot(shard_ids, config.SHARD_COUNT or None))
+        return
+
+    recommended, max_concurrency = asyncio.run(fetch_gateway_info(config.DISCORD_TOKEN))
+    shard_count = config.SHARD_COUNT or recommended
+    chunks = split_shards(shard_ids or list(range(shard_count)), config.CLUSTERS)
+    log.info(
+        "Running %s shards of %s in %s clusters",
+        sum(map(len, chunks)),
+        shard_count,
+        len(chunks),
+    )
+
+    target = functools.partial(
+        run_cluster, shard_count=shard_count, clusters=len(chunks)
+    )
+    supervisor = ClusterSupervisor(
+        target, chunks, identify_delay=IDENTIFY_INTERVAL / max_concurrency
+    )
+    supervisor.run()
+
+
+def run_cluster(cluster_id, shard_ids, shard_count, clusters):
+    # Ctrl+C reaches the whole process group, leave stopping to the supervisor
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    setup_logging(cluster_id)
+    asyncio.run(run_bot(shard_ids, shard_count, cluster_id, clusters))
+
+
+async def run_bot(shard_ids=None, shard_count=None, cluster_id=None, clusters=1):
     token = config.DISCORD_TOKEN
 
     # add every cog in the top level cogs folder (ignore subdirectories, these are not cogs)
@@ -17,18 +65,28 @@ async def main():
         if filename.endswith(".py"):
             cogs.append("cogs." + filename[:-3])
 
-    bot = Cosmo(cogs)
+    bot = Cosmo(
+        cogs,
+        shard_ids=shard_ids,
+        shard_count=shard_count,
+        cluster_id=cluster_id,
+        clusters=clusters,
+    )
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGTERM, lambda: loop.create_task(bot.close()))
     async with bot:
         await bot.start(token)
 
 
-def setup_logging():
+def setup_logging(cluster_id=None):
     max_bytes = 32 * 1024 * 1024
     log = logging.getLogger()
     log.setLevel(logging.INFO)
 
+    # Processes can't share a rotating file, so every cluster gets its own
+    filename = "cosmo.log" if cluster_id is None else f"cosmo-{cluster_id}.log"
     file_handler = RotatingFileHandler(
-        filename="cosmo.log",
+        filename=filename,
         encoding="utf-8",
         mode="w",
         maxBytes=max_bytes,
@@ -36,17 +94,35 @@ def setup_logging():
     )
 
     date_format = "%m-%d-%Y %I:%M:%S %p"
-    format = logging.Formatter("[{asctime}] {name}: {message}", date_format, style="{")
+    prefix = "" if cluster_id is None else f"[cluster {cluster_id}] "
+    format = logging.Formatter(
+        prefix + "[{asctime}] {name}: {message}", date_format, style="{"
+    )
     file_handler.setFormatter(format)
     file_handler.setLevel(logging.WARNING)
-    log.addHandler(file_handler)
+    handlers = [file_handler]
 
     if config.BOT_DEBUG:
         console_handler = logging.StreamHandler()
         console_handler.setFormatter(format)
         console_handler.setLevel(logging.DEBUG)
-        log.addHandler(console_handler)
+        handlers.append(console_handler)
+
+    # Writing to disk (and rolling over) on the event loop stalls every
+    # command, so the loop only queues records and a thread writes them
+    if config.LOG_QUEUE_SIZE:
+        queue_handler = LogQueueHandler(config.LOG_QUEUE_SIZE)
+        listener = queue_handler.listen(handlers)
+        atexit.register(listener.stop)
+        handlers = [queue_handler]
+
+    for handler in handlers:
+        if config.LOG_REPEAT_LIMIT:
+            handler.addFilter(
+                RepeatFilter(config.LOG_REPEAT_LIMIT, config.LOG_REPEAT_WINDOW)
+            )
+        log.addHandler(handler)
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    main()